@@ -1,46 +1,108 @@
 # app.py
 # Main Flask application for CloneMe - A dating app where users create AI clones that interact and match.
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory, Response, stream_with_context, jsonify, g, abort, before_render_template, template_rendered
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 import os
 import json
-from forms import RegistrationForm, LoginForm, CloneCreationForm
-from models import init_db, User, Clone, Question, Answer
-from llm import generate_conversation, calculate_compatibility, generate_persona 
-import google.generativeai as genai
-from PIL import Image
+import time
+import threading
+import contextvars
+import hashlib
+import logging
+import mimetypes
 
 # Import from other modules
-from models import init_db, User, Clone, Question, Answer  # Database models
+from models import init_db, User, Clone, Answer  # Database models
 from forms import RegistrationForm, LoginForm, CloneCreationForm  # WTForms for validation
-from llm import generate_conversation, calculate_compatibility  # LLM helpers
+from llm import generate_persona, patch_persona  # LLM helpers
+from matching import load_match, stream_match, invalidate_matches  # Concurrent, cached candidate scoring
+from prefilter import encode_answers  # Vectorized Likert prefilter
+from top_matches import load_top_matches  # Per-clone match lists maintained by background jobs
+from tasks import enqueue_composite, enqueue_persona, enqueue_refresh, refresh_top_matches, set_clone_status  # Background jobs (run by worker.py)
+from imaging import composite_to_store, picture_sources  # Robot profile picture compositing
+from storage import store_stream, write_once, content_etag  # Content-addressed uploads (uploads/<aa>/<sha256>.<ext>)
+from fingerprint import clone_fingerprint, changed_answers  # Skip regeneration when inputs are unchanged
 from questions import DEFAULT_QUESTIONS  # Separate file for questions
+import metrics  # Per-call LLM latency/token/cost metrics
+import tracing  # Per-request spans -> Server-Timing header and sampled trace log
+import db  # One tuned connection per request (WAL, pragmas, statement cache)
+from db import get_db
+
+# Before the app is created, so app.logger uses this handler instead of adding Flask's own
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 app = Flask(__name__)
 app.secret_key = 'super_secret_key'  # Change to a secure random key in production
 app.config['UPLOAD_FOLDER'] = 'uploads'  # Folder for CSV uploads
+app.config['STAGING_FOLDER'] = os.getenv('STAGING_FOLDER', 'staging')  # Uploads waiting for a worker.py job (not served)
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '0') == '1'  # Let Apache/lighttpd send upload bytes
+app.config['UPLOADS_ACCEL_REDIRECT'] = os.getenv('UPLOADS_ACCEL_REDIRECT')  # nginx internal location for uploads, e.g. /_uploads/
 app.config['ALLOWED_EXTENSIONS'] = {'txt', 'jpg', 'png', 'jpeg'}  # Allowed file types
 app.config['APP_NAME'] = 'CloneMe'  # Define app name here
+app.config['USE_JOB_QUEUE'] = os.getenv('USE_JOB_QUEUE', '1') == '1'  # Run LLM work on worker.py instead of inline
+app.config['MATCH_CANDIDATES'] = int(os.getenv('MATCH_CANDIDATES', 5))  # Top-K clones sent to the LLM per top-match refresh
+app.config['MATCH_MAX_WORKERS'] = int(os.getenv('MATCH_MAX_WORKERS', 8))  # Bounded pool for candidate pipelines
+app.config['MATCH_SAMPLE_POOL'] = int(os.getenv('MATCH_SAMPLE_POOL', 5000))  # Clones ranked per refresh (a random window, not the whole table)
+app.config['TOP_MATCHES'] = int(os.getenv('TOP_MATCHES', 10))  # Matches shown by date_clones (and kept per clone)
+app.config['PERSONA_PATCH_MAX_CHANGES'] = int(os.getenv('PERSONA_PATCH_MAX_CHANGES', 3))  # Patch the persona instead of rebuilding it for up to this many changed answers
+app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', '1') == '1'  # Per-request span breakdown in a response header
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # Cache lifetime for content-addressed uploads
 
-# Ensure upload folder exists
+# Ensure upload folders exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['STAGING_FOLDER'], exist_ok=True)
 
 # Initialize database
 init_db()
+db.init_app(app)  # A connection per request, closed on teardown
 
-# LLM Client (placeholder; configure with your API key)
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+# LLM clients are created lazily and shared per process (see llm_client.py)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+@app.before_request
+def tag_metrics_route():
+    # LLM calls made while handling this request (and streaming its response) count towards its endpoint
+    metrics.set_route(request.endpoint or 'unknown')
+    tracing.start(request.endpoint or 'unknown')
+
+@app.after_request
+def add_server_timing(response):
+    trace = tracing.current()
+    if trace is None:
+        return response
+    if app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = trace.server_timing()
+    # Streamed responses keep adding spans until the body is done
+    method, path = request.method, request.path
+    response.call_on_close(lambda: tracing.finish(trace, method, path, response.status_code))
+    return response
+
+@before_render_template.connect_via(app)
+def start_template_span(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def end_template_span(sender, template, context, **extra):
+    tracing.record('template', g.pop('template_started', time.perf_counter()), template.name)
+
 @app.context_processor
 def inject_app_name():
     return dict(app_name=app.config['APP_NAME'])  # Make app_name available to all templates
 
+@app.context_processor
+def inject_picture_sources():
+    def image_sources(path):
+        # <source> entries (WebP/AVIF srcsets) for a profile picture; empty for the default robot
+        with tracing.span('fs', 'derivatives'):
+            return picture_sources(path)
+    return dict(image_sources=image_sources)
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegistrationForm()
@@ -49,7 +111,7 @@ def register():
         password = form.password.data
         password_hash = generate_password_hash(password)
         
-        conn = sqlite3.connect('users.db')
+        conn = get_db()
         cursor = conn.cursor()
         try:
             cursor.execute('INSERT INTO users (username, password_hash) VALUES (?, ?)', (username, password_hash))
@@ -57,9 +119,8 @@ def register():
             flash('Registration successful! Please log in.', 'success')
             return redirect(url_for('login'))
         except sqlite3.IntegrityError:
+            conn.rollback()
             flash('Username already exists.', 'error')
-        finally:
-            conn.close()
     return render_template('register.html', form=form)
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -69,14 +130,11 @@ def login():
         username = form.username.data
         password = form.password.data
         
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, password_hash FROM users WHERE username = ?', (username,))
-        result = cursor.fetchone()
-        conn.close()
+        conn = get_db()
+        user = User.by_username(conn.cursor(), username)
         
-        if result and check_password_hash(result[1], password):
-            session['user_id'] = result[0]
+        if user and check_password_hash(user.password_hash, password):
+            session['user_id'] = user.id
             session['username'] = username
             flash('Login successful!', 'success')
             return redirect(url_for('home'))
@@ -89,25 +147,98 @@ def login():
 def home():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    conn = sqlite3.connect('users.db')
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT id, profile_pic_path FROM clones WHERE user_id = ?', (session['user_id'],))
+    cursor.execute('SELECT id, profile_pic_path, persona_status, image_status FROM clones WHERE user_id = ?', (session['user_id'],))
     clone = cursor.fetchone()
     cursor.execute('SELECT username FROM users WHERE id = ?', (session['user_id'],))
     username = cursor.fetchone()[0]
-    conn.close()
     has_clone = clone is not None
     profile_pic_path = clone[1] if clone and clone[1] else '/static/robot.png'
-    print(f'Database profile_pic_path: {clone[1] if clone else None}')  # Debug
+    app.logger.debug('Database profile_pic_path: %s', clone[1] if clone else None)
     # Normalize path and check existence
     if profile_pic_path and profile_pic_path != '/static/robot.png':
         profile_pic_path = profile_pic_path.replace('Uploads', 'uploads')
         absolute_path = os.path.join(app.root_path, profile_pic_path.lstrip('/'))
-        if not os.path.exists(absolute_path):
-            print(f'Image not found: {absolute_path}, using fallback')
+        with tracing.span('fs', 'exists'):
+            found = os.path.exists(absolute_path)
+        if not found:
+            app.logger.warning('Image not found: %s, using fallback', absolute_path)
             profile_pic_path = '/static/robot.png'
-    print(f'Profile pic path: {profile_pic_path}')  # Debug
-    return render_template('home.html', has_clone=has_clone, username=username, profile_pic_path=profile_pic_path)
+    app.logger.debug('Profile pic path: %s', profile_pic_path)
+    generating = has_clone and 'pending' in (clone[2], clone[3])
+    return render_template('home.html', has_clone=has_clone, username=username, profile_pic_path=profile_pic_path,
+                           generating=generating)
+
+@app.route('/clone_status')
+def clone_status():
+    # Polled by home.html while the persona and profile picture are generated in the background
+    if 'user_id' not in session:
+        return jsonify({'error': 'not logged in'}), 401
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT persona_status, image_status, profile_pic_path FROM clones WHERE user_id = ?', (session['user_id'],))
+    clone = cursor.fetchone()
+    if not clone:
+        return jsonify({'has_clone': False}), 404
+    persona_status, image_status, profile_pic_path = clone
+    steps = [persona_status] + ([image_status] if image_status else [])
+    return jsonify({
+        'has_clone': True,
+        'persona_status': persona_status,
+        'image_status': image_status,
+        'profile_pic_path': profile_pic_path,
+        'progress': sum(status != 'pending' for status in steps) / len(steps),
+        'done': 'pending' not in steps,
+    })
+
+def start_composite(clone_id, image_data, image_hash):
+    # With the job queue the upload is staged on disk and composited by worker.py, so a pending picture
+    # survives a restart; without it, it is composited inline like the persona. Either way the clone
+    # row is only updated if no different picture was uploaded in the meantime.
+    if app.config['USE_JOB_QUEUE']:
+        staged_path = os.path.join(app.config['STAGING_FOLDER'], f'{clone_id}-{image_hash}')
+        with tracing.span('fs', 'stage upload'):
+            write_once(staged_path, lambda f: f.write(image_data))
+        enqueue_composite(clone_id, image_hash, staged_path, app.config['UPLOAD_FOLDER'])
+        return
+    try:
+        with tracing.span('image', 'composite'):
+            composite_path = composite_to_store(image_data, app.config['UPLOAD_FOLDER'])
+    except Exception:
+        app.logger.exception('Image processing error for clone %s', clone_id)
+        set_clone_status(clone_id, 'image_status', 'failed', expect={'image_hash': image_hash})
+    else:
+        set_clone_status(clone_id, 'image_status', 'ready', expect={'image_hash': image_hash},
+                         profile_pic_path=composite_path)
+
+# (clone id, version) refreshes running on a thread, so repeated page views don't start another
+# (the job queue's dedupe_key does the same with worker.py)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def start_refresh(clone_id, version):
+    # Re-score the pairs this version of the clone affects, on worker.py or (without the job
+    # queue) on a background thread; date_clones shows the results as they are merged in
+    if app.config['USE_JOB_QUEUE']:
+        enqueue_refresh(clone_id, version)
+        return
+    key = (clone_id, version)
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    def run():
+        try:
+            refresh_top_matches(clone_id, version, shortlist=app.config['MATCH_CANDIDATES'],
+                                pool=app.config['MATCH_SAMPLE_POOL'], max_workers=app.config['MATCH_MAX_WORKERS'])
+        except Exception:
+            app.logger.exception('Top match refresh failed for clone %s', clone_id)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+    # Carry the request's context (metrics route) into the thread, as matching._submit does
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
 
 @app.route('/create_clone', methods=['GET', 'POST'])
 def create_clone():
@@ -118,18 +249,21 @@ def create_clone():
     form.questions = DEFAULT_QUESTIONS  # Attach questions for template rendering
 
     # Check if user has existing clone and pre-fill answers
-    conn = sqlite3.connect('users.db')
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT answers_json, name FROM clones WHERE user_id = ?', (session['user_id'],))
+    cursor.execute('''
+        SELECT name, persona_status, id, persona, text_path, text_hash, fingerprint,
+               profile_pic_path, image_status, image_hash
+        FROM clones WHERE user_id = ?
+    ''', (session['user_id'],))
     existing_clone = cursor.fetchone()
-    conn.close()
-    pre_filled_answers = json.loads(existing_clone[0]) if existing_clone else {}
-    pre_filled_name = existing_clone[1] if existing_clone and existing_clone[1] is not None else ''
+    pre_filled_answers = Answer.for_clones(cursor, [existing_clone[2]])[existing_clone[2]] if existing_clone else {}
+    pre_filled_name = existing_clone[0] if existing_clone and existing_clone[0] is not None else ''
     
-    print(f'Pre-filled name from database: {pre_filled_name}')  # Debug
+    app.logger.debug('Pre-filled name from database: %s', pre_filled_name)
     if request.method == 'GET':
         form.name.data = pre_filled_name
-        print(f'Set form.name.data to: {form.name.data}')  # Debug
+        app.logger.debug('Set form.name.data to: %s', form.name.data)
     for q in DEFAULT_QUESTIONS:
         if q['id'] in pre_filled_answers:
             setattr(form, q['id'], pre_filled_answers[q['id']])
@@ -138,89 +272,112 @@ def create_clone():
         try:
             # Collect answers, handling skips
             answers = {q['id']: request.form.get(q['id']) or None for q in DEFAULT_QUESTIONS}
+            (old_persona_status, old_clone_id, old_persona, old_text_path, old_text_hash, old_fingerprint,
+             old_pic_path, old_image_status, old_image_hash) = existing_clone[1:] if existing_clone else (None,) * 9
             
-            # Handle text file upload
+            # Handle text file upload; without a new one the previous file is kept
             text_file = form.text_file.data  # Changed from csv_file
-            text_path = None
+            text_path, text_hash = old_text_path, old_text_hash
             if text_file and allowed_file(text_file.filename):
-                filename = secure_filename(text_file.filename)
-                text_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                text_file.save(text_path)
+                extension = text_file.filename.rsplit('.', 1)[1].lower()  # Checked by allowed_file
+                with tracing.span('fs', 'save text file'):
+                    text_path, text_hash = store_stream(text_file.stream, extension, app.config['UPLOAD_FOLDER'])
             
-            # Handle profile picture upload and composite with robot
+            # Handle profile picture upload; it is read into memory and composited with the robot
+            # by start_composite
             profile_pic_file = form.profile_pic.data
-            profile_pic_path = None
+            image_data = None
+            image_hash = old_image_hash
             if profile_pic_file and allowed_file(profile_pic_file.filename):
-                filename = secure_filename(profile_pic_file.filename)
-                temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_{filename}")
-                print(f'Saving temp file: {temp_path}')  # Debug
-                profile_pic_file.save(temp_path)
+                image_data = profile_pic_file.read()
+                image_hash = hashlib.sha256(image_data).hexdigest()
+                if image_hash == old_image_hash and old_image_status in ('pending', 'ready'):
+                    image_data = None  # Same picture as before, no need to composite it again
             
-                # Generate composite image
-                try:
-                    # Load images
-                    print(f'Opening user image: {temp_path}')  # Debug
-                    user_img = Image.open(temp_path).convert('RGBA')
-                    print(f'Opening robot image: static/robot.png')  # Debug
-                    robot_img = Image.open(os.path.join('static', 'robot.png')).convert('RGBA')
-                    
-                    # Resize user image to fit robot head (adjust size as needed)
-                    head_size = (202, 167)  # Example size; adjust based on robot.png
-                    user_img = user_img.resize(head_size, Image.Resampling.LANCZOS)
-                    
-                    # Define position for head (adjust x, y coordinates based on robot.png)
-                    head_position = (187, 96)  # Example: top-left corner of head area
-                    
-                    # Create composite image
-                    composite_img = robot_img.copy()
-                    composite_img.paste(user_img, head_position, user_img)  # Use alpha channel for transparency
-                    
-                    # Save composite image
-                    profile_pic_path = os.path.join(app.config['UPLOAD_FOLDER'], f"composite_{filename}")
-                    absolute_path = os.path.join(app.root_path, profile_pic_path)
-                    print(f'Saving composite image: {absolute_path}')  # Debug
-                    composite_img.save(profile_pic_path, 'PNG')
-                    print(f'Saved composite image: {absolute_path}')  # Debug
-                    
-                    # Clean up temporary file
-                    print(f'Removing temp file: {temp_path}')  # Debug
-                    os.remove(temp_path)
-                except Exception as e:
-                    flash(f'Error processing profile picture: {str(e)}', 'error')
-                    print(f'Image processing error: {str(e)}')
-                    profile_pic_path = None
+            # Nothing the persona depends on changed: keep it (and the clone's cached matches)
+            fingerprint = clone_fingerprint(answers, form.name.data, text_hash)
+            if fingerprint == old_fingerprint and old_persona_status in ('pending', 'ready'):
+                if image_data is None:
+                    flash('Your clone is already being created.' if old_persona_status == 'pending'
+                          else 'No changes to your clone.', 'success')
+                    return redirect(url_for('home'))
+                conn = get_db()
+                conn.execute("UPDATE clones SET image_status = 'pending', image_hash = ? WHERE id = ?",
+                             (image_hash, old_clone_id))
+                conn.commit()
+                start_composite(old_clone_id, image_data, image_hash)
+                flash('Profile picture updated!', 'success')
+                return redirect(url_for('home'))
             
-            print(f'Final profile_pic_path: {profile_pic_path}')  # Debug
-
-            # Generate persona using LLM
-            try:
-                persona = generate_persona(answers, text_path)
-            except Exception as e:
-                flash(f'Error generating persona: {str(e)}', 'error')
-                persona = "Unable to generate persona due to API error."
+            # Same text file and only a few answers changed: patch the previous persona instead of
+            # rebuilding it (a name change alone doesn't touch the persona at all)
+            base_persona, changed = None, None
+            if old_persona_status == 'ready' and text_hash == old_text_hash:
+                changed = changed_answers(pre_filled_answers, answers)
+                if len(changed) <= app.config['PERSONA_PATCH_MAX_CHANGES']:
+                    base_persona = old_persona
             
-            print("Generated Persona:")
-            print(persona)
+            persona = None
+            persona_status = 'pending'
+            if base_persona is not None and not changed:
+                persona, persona_status = base_persona, 'ready'
+            profile_pic_path, image_status = (old_pic_path, old_image_status) if existing_clone else (None, None)
+            if image_data is not None:
+                image_status = 'pending'
+            if not app.config['USE_JOB_QUEUE']:
+                # No worker: generate persona inline
+                if persona_status == 'pending':
+                    try:
+                        if base_persona is not None:
+                            persona = patch_persona(base_persona, changed)
+                        else:
+                            persona = generate_persona(answers, text_path)
+                        persona_status = 'ready'
+                    except Exception as e:
+                        flash(f'Error generating persona: {str(e)}', 'error')
+                        persona_status = 'failed'
+                
+                app.logger.debug('Generated persona:\n%s', persona)
 
-            # Save to database
-            conn = sqlite3.connect('users.db')
+            # Save to database right away; the page polls clone_status until generation finishes
+            conn = get_db()
             cursor = conn.cursor()
-            # Delete existing clone if restarting
-            cursor.execute('DELETE FROM clones WHERE user_id = ?', (session['user_id'],))
-            cursor.execute('''
-                INSERT INTO clones (user_id, answers_json, text_path, persona, profile_pic_path, name)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (session['user_id'], json.dumps(answers), text_path, persona, profile_pic_path, form.name.data))
+            # An existing clone is updated in place, so its id (and every link to it) survives the edit;
+            # its version is bumped, the replaced state is archived in clone_history by a trigger, and
+            # matches made with the old version are dropped. The picture columns are only written with
+            # a new upload, so a composite that lands meanwhile isn't overwritten.
+            updated = ['answers_json', 'text_path', 'persona', 'name', 'answers_vec', 'persona_status',
+                       'fingerprint', 'text_hash']
+            if image_data is not None:
+                updated += ['profile_pic_path', 'image_status', 'image_hash']
+            cursor.execute(f'''
+                INSERT INTO clones (user_id, answers_json, text_path, persona, profile_pic_path, name, answers_vec,
+                                    persona_status, image_status, fingerprint, text_hash, image_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    {', '.join(f'{column} = excluded.{column}' for column in updated)}, version = version + 1
+                RETURNING id, version
+            ''', (session['user_id'], json.dumps(answers), text_path, persona, profile_pic_path, form.name.data,
+                  encode_answers(answers), persona_status, image_status, fingerprint, text_hash, image_hash))
+            clone_id, version = cursor.fetchone()
+            invalidate_matches(cursor, clone_id, version)
+            Answer.save_all(cursor, clone_id, answers)
             conn.commit()
-            conn.close()
+            
+            if app.config['USE_JOB_QUEUE'] and persona_status == 'pending':
+                enqueue_persona(clone_id, version, base_persona, changed)  # Refreshes top matches when done
+            elif persona_status == 'ready':
+                start_refresh(clone_id, version)
+            if image_data is not None:
+                start_composite(clone_id, image_data, image_hash)
             
             flash('Clone created successfully!', 'success')
             return redirect(url_for('home'))
         except Exception as e:
             flash(f'Error creating clone: {str(e)}', 'error')
-            print(f'Error in create_clone: {str(e)}')  # Debug to terminal
+            app.logger.exception('Error in create_clone')
     else:
-        print(f'Form validation failed: {form.errors}')  # Debug validation errors
+        app.logger.debug('Form validation failed: %s', form.errors)
 
     return render_template('create_clone.html', form=form, pre_filled_answers=pre_filled_answers, pre_filled_name=pre_filled_name)
 
@@ -229,109 +386,96 @@ def date_clones():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    # Fetch other clones (exclude user's own)
-    conn = sqlite3.connect('users.db')
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT c.id, u.username, c.answers_json, c.persona, c.profile_pic_path, c.name 
-        FROM clones c 
-        JOIN users u ON c.user_id = u.id 
-        WHERE c.user_id != ?
-    ''', (session['user_id'],))
-    other_clones = cursor.fetchall()
-    
     # Fetch user's clone
-    cursor.execute('SELECT answers_json, persona, name FROM clones WHERE user_id = ?', (session['user_id'],))
+    cursor.execute('SELECT id, version, persona_status, top_matches_version FROM clones WHERE user_id = ?',
+                   (session['user_id'],))
     user_clone = cursor.fetchone()
-    conn.close()
     
     if not user_clone:
         flash('Create your clone first!', 'error')
         return redirect(url_for('create_clone'))
-    user_answers = json.loads(user_clone[0])
-    user_persona = user_clone[1]
-    user_name = user_clone[2] if user_clone[2] is not None else 'No_Name'
+    if user_clone[2] == 'failed':
+        flash('We could not generate your clone\'s persona. Please restart your clone.', 'error')
+        return redirect(url_for('home'))
+    if user_clone[2] != 'ready':
+        flash('Your clone is still being generated. Check back in a moment!', 'error')
+        return redirect(url_for('home'))
+    clone_id, version = user_clone[0], user_clone[1]
     
-    # Select 5 random clones (or all if fewer than 5)
-    import random
-    selected_clones = random.sample(other_clones, min(5, len(other_clones))) if other_clones else []
+    # Matches are scored in the background whenever a clone is created or edited and merged into
+    # each clone's list, so this is one indexed read (see top_matches.py)
+    matches = load_top_matches(cursor, clone_id, version, app.config['TOP_MATCHES'])
+    if not matches and user_clone[3] != version:
+        start_refresh(clone_id, version)  # A clone from before the lists existed, or its refresh is still running
     
     clones_with_scores = []
-    for clone_id, username, answers_json, other_persona, profile_pic_path, name in selected_clones:
-        other_answers = json.loads(answers_json)
-        # Generate conversation for compatibility
-        conversation = generate_conversation(user_answers, user_persona, other_answers, other_persona, user_name, name or 'No_Name')
-        # Remove name prefixes from conversation
-        lines = conversation.split('\n')
-        cleaned_lines = []
-        for line in lines:
-            line = line.strip()
-            if line.startswith('You:'):
-                cleaned_lines.append(line[4:].strip())
-            elif line.startswith(f'{name or "No_Name"}:'):
-                cleaned_lines.append(line[len(name or "No_Name")+1:].strip())
-            elif line.startswith(f'{user_name}:'):
-                cleaned_lines.append(line[len(user_name)+1:].strip())
-            elif line:
-                cleaned_lines.append(line)
-        cleaned_conversation = '\n'.join(cleaned_lines)
-        score = calculate_compatibility(user_answers, other_answers, cleaned_conversation)  # Pass conversation
-        print(f'Compatibility score for {username} ({name}): {score}')  # Debug
+    for match in matches:
+        app.logger.debug('Compatibility score for %s (%s): %s', match['username'], match['name'], match['score'])
         clones_with_scores.append({
-            'id': clone_id,
-            'username': username,
-            'score': score,
-            'profile_pic': profile_pic_path or '/static/default_profile.png',
-            'name': name or 'No Name'
+            'id': match['id'],
+            'username': match['username'],
+            'score': match['score'],
+            'profile_pic': match['profile_pic'] or '/static/default_profile.png',
+            'name': match['name'] if match['name'] != 'No_Name' else 'No Name'
         })
             
     return render_template('date_clones.html', clones=clones_with_scores)
 
+def load_match_pair(clone_id):
+    """Fetch the viewer's clone and clone `clone_id` as matching dicts, plus the other's display name."""
+    cursor = get_db().cursor()
+    user_clone = Clone.by_user(cursor, session['user_id'])
+    other_clone = Clone.by_id(cursor, clone_id)
+    
+    if not user_clone or not other_clone:
+        return None
+    return user_clone.as_match_dict(), other_clone.as_match_dict(), other_clone.name or 'Contact'
+
 @app.route('/view_match/<int:clone_id>')
 def view_match(clone_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    # Fetch clones including personas
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT answers_json, persona, name FROM clones WHERE user_id = ?', (session['user_id'],))
-    user_clone = cursor.fetchone()
-    
-    cursor.execute('SELECT answers_json, persona, name FROM clones WHERE id = ?', (clone_id,))
-    other_clone = cursor.fetchone()
-    
-    # Fetch other username
-    cursor.execute('SELECT name FROM clones WHERE id = ?', (clone_id,))
-    other_username = cursor.fetchone()[0] or 'Contact'
-    conn.close()
-    
-    if not user_clone or not other_clone:
+    pair = load_match_pair(clone_id)
+    if not pair:
         flash('Clone not found.', 'error')
         return redirect(url_for('date_clones'))
+    user, other, other_username = pair
     
-    user_answers, user_persona, user_name = json.loads(user_clone[0]), user_clone[1], user_clone[2] if user_clone[2] is not None else 'No_Name'
-    other_answers, other_persona, other_name = json.loads(other_clone[0]), other_clone[1], other_clone[2] if other_clone[2] is not None else 'No_Name'
+    # Reuse the conversation date_clones scored for this pair; on a miss the page streams it in
+    cached = load_match(user, other)
+    if cached is None:
+        return render_template('view_match.html', conversation='', other_username=other_username,
+                               stream_url=url_for('view_match_stream', clone_id=clone_id))
+    
+    # A pair's conversation may have been generated for the other clone, which then speaks first
+    return render_template('view_match.html', conversation=cached['conversation'], other_username=other_username,
+                           other_starts=cached['reversed'])
+
+@app.route('/view_match/<int:clone_id>/stream')
+def view_match_stream(clone_id):
+    if 'user_id' not in session:
+        return Response(status=401)
     
-    # Generate sample conversation using personas
-    conversation = generate_conversation(user_answers, user_persona, other_answers, other_persona, user_name, other_name)
+    pair = load_match_pair(clone_id)
+    if not pair:
+        return Response(status=404)
+    user, other, _ = pair
     
-    # Remove name prefixes (You: and other_name:) from conversation
-    lines = conversation.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        line = line.strip()
-        if line.startswith('You:'):
-            cleaned_lines.append(line[4:].strip())
-        elif line.startswith(f'{other_name}:'):
-            cleaned_lines.append(line[len(other_name)+1:].strip())
-        elif line.startswith(f'{user_name}:'):
-            cleaned_lines.append(line[len(user_name)+1:].strip())
-        elif line:
-            cleaned_lines.append(line)
-    conversation = '\n'.join(cleaned_lines)
+    # Server-Sent Events: one event per cleaned message, then a final 'done' event
+    def events():
+        try:
+            for mine, line in stream_match(user, other):
+                yield f'data: {json.dumps({"text": line, "mine": mine})}\n\n'
+        except Exception:
+            app.logger.exception('Streaming conversation failed')
+            yield 'event: error\ndata: {}\n\n'
+        yield 'event: done\ndata: {}\n\n'
     
-    return render_template('view_match.html', conversation=conversation, other_username=other_username)
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/logout')
 def logout():
@@ -341,7 +485,34 @@ def logout():
 
 @app.route('/uploads/<path:filename>')
 def serve_uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Content-addressed files never change: strong ETag from the hash, cached for a year as immutable.
+    # Legacy files (named after the upload) still get Flask's default conditional handling.
+    etag = content_etag(filename)
+    if etag is None:
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+    accel_prefix = app.config['UPLOADS_ACCEL_REDIRECT']
+    if accel_prefix:
+        # nginx sends the bytes from its internal location; 304s are answered here without touching the file
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename
+        response.set_etag(etag)
+        response = response.make_conditional(request)
+    else:
+        # send_file answers If-None-Match with a 304 and honours USE_X_SENDFILE
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus scrape target (per process)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
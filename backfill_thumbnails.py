@@ -0,0 +1,49 @@
+# backfill_thumbnails.py
+# Generates the WebP/AVIF srcset derivatives for profile pictures composited before they existed:
+#   python backfill_thumbnails.py -j 4
+# Derivatives that already exist are served as immutable and are never rewritten.
+
+import argparse
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from imaging import backfill_derivatives
+
+
+def _backfill(path):
+    try:
+        return path, backfill_derivatives(path), None
+    except Exception as e:
+        return path, 0, e
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate missing profile picture thumbnails.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect('users.db')
+    cursor = conn.cursor()
+    cursor.execute('SELECT DISTINCT profile_pic_path FROM clones WHERE profile_pic_path IS NOT NULL')
+    paths = [row[0].lstrip('/') for row in cursor.fetchall()]
+    conn.close()
+
+    missing = [path for path in paths if not os.path.exists(path)]
+    for path in missing:
+        print(f'Missing composite, skipped: {path}')
+    jobs = [path for path in paths if os.path.exists(path)]
+
+    written = failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for path, count, error in pool.map(_backfill, jobs, chunksize=8):
+            if error:
+                failed += 1
+                print(f'Failed: {path}: {error}')
+            else:
+                written += count
+    print(f'{len(jobs)} pictures checked, {written} derivatives written, {failed} failed, {len(missing)} missing.')
+
+
+if __name__ == '__main__':
+    main()
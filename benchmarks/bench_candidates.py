@@ -0,0 +1,140 @@
+# benchmarks/bench_candidates.py
+# Per-page-view cost of picking date_clones candidates as the clones table grows:
+#   legacy       every other clone's full row (persona, answers_json) loaded, then random.sample
+#   full scan    every ready clone's answer vector scored, heavy columns for the top K only
+#   window rank  candidates.ranked_candidates: a MATCH_SAMPLE_POOL window of the shuffled order scored
+#   window rand  candidates.random_candidates: K rows straight from the shuffled order
+#   top list     top_matches.load_top_matches: the viewer's precomputed list (what date_clones reads now)
+#
+#   python benchmarks/bench_candidates.py                          # 10k, 100k and 1M clones
+#   python benchmarks/bench_candidates.py --sizes 10000 --runs 20
+#
+# Databases are built in a temp directory with the real schema (migrations.py). The answers table is
+# left empty to keep the 1M build short, so answer loading is timed on empty result sets. Every clone
+# gets a full top_matches list (TOP_N rows) pointing at pseudo-random others.
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from candidates import DEFAULT_POOL, load_candidates, random_candidates, ranked_candidates
+from migrations import migrate
+from prefilter import LIKERT_QUESTIONS, decode_vectors, encode_answers, top_k
+from top_matches import TOP_N, load_top_matches
+
+K = 5
+
+
+def build(path, n_clones, persona_chars):
+    conn = db.connect(path, autocommit=True)
+    migrate(conn)
+    rng = random.Random(0)
+    persona = ('A persona paragraph about hobbies, humor and dates. ' * (persona_chars // 52 + 1))[:persona_chars]
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+                     ((i, f'user{i}', 'x' * 100) for i in range(1, n_clones + 1)))
+
+    def rows():
+        for i in range(1, n_clones + 1):
+            answers = {q['id']: rng.choice(q['options']) for q in LIKERT_QUESTIONS}
+            yield (i, json.dumps(answers), persona, f'uploads/{i}.png', f'Clone {i}', encode_answers(answers),
+                   rng.randint(-2 ** 63, 2 ** 63 - 1))
+    conn.executemany('''
+        INSERT INTO clones (user_id, answers_json, persona, profile_pic_path, name, answers_vec, persona_status,
+                            sample_key)
+        VALUES (?, ?, ?, ?, ?, ?, 'ready', ?)
+    ''', rows())
+    conn.execute('''
+        WITH RECURSIVE k(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM k WHERE n < ?)
+        INSERT OR IGNORE INTO top_matches (clone_id, other_clone_id, clone_version, other_version, score)
+        SELECT c.id, (c.id + k.n * 7919) % ? + 1, 1, 1, abs(random() % 100) FROM clones c, k
+    ''', (TOP_N, n_clones))
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def legacy(cursor, user_id, viewer_vec):
+    cursor.execute('''
+        SELECT c.id, u.username, c.answers_json, c.persona, c.profile_pic_path, c.name
+        FROM clones c JOIN users u ON c.user_id = u.id WHERE c.user_id != ?
+    ''', (user_id,))
+    rows = [(row[0], row[1], json.loads(row[2]), *row[3:]) for row in cursor.fetchall()]
+    return random.sample(rows, min(K, len(rows)))
+
+
+def full_scan(cursor, user_id, viewer_vec):
+    cursor.execute("SELECT id, answers_vec FROM clones WHERE user_id != ? AND persona_status = 'ready'", (user_id,))
+    rows = cursor.fetchall()
+    best = top_k(viewer_vec, decode_vectors([vec for _, vec in rows]), K)
+    return load_candidates(cursor, [rows[i][0] for i in best])
+
+
+def window_rank(cursor, user_id, viewer_vec):
+    return load_candidates(cursor, ranked_candidates(cursor, viewer_vec, user_id, K, pool=DEFAULT_POOL, seed=user_id))
+
+
+def window_random(cursor, user_id, viewer_vec):
+    return load_candidates(cursor, random_candidates(cursor, user_id, K))
+
+
+def top_list(cursor, user_id, viewer_vec):
+    cursor.execute('SELECT id, version FROM clones WHERE user_id = ?', (user_id,))
+    return load_top_matches(cursor, *cursor.fetchone(), K)
+
+
+METHODS = [('legacy', legacy), ('full scan', full_scan), ('window rank', window_rank), ('window rand', window_random),
+           ('top list', top_list)]
+
+
+def bench(path, n_clones, runs, legacy_max):
+    conn = db.connect(path)
+    cursor = conn.cursor()
+    rng = random.Random(1)
+    for label, method in METHODS:
+        if label == 'legacy' and n_clones > legacy_max:
+            print(f'{n_clones:>9}  {label:<12} skipped (above --legacy-max; it loads every row)')
+            continue
+        samples = []
+        for _ in range(runs):
+            user_id = rng.randint(1, n_clones)
+            viewer_vec = cursor.execute('SELECT answers_vec FROM clones WHERE user_id = ?', (user_id,)).fetchone()[0]
+            start = time.perf_counter()
+            method(cursor, user_id, viewer_vec)
+            samples.append((time.perf_counter() - start) * 1000)
+        tracemalloc.start()
+        method(cursor, 1, cursor.execute('SELECT answers_vec FROM clones WHERE user_id = 1').fetchone()[0])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{n_clones:>9}  {label:<12} median {statistics.median(samples):10.2f} ms   '
+              f'max {max(samples):10.2f} ms   peak Python memory {peak / 1e6:8.2f} MB', flush=True)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--runs', type=int, default=10, help='page views timed per method')
+    parser.add_argument('--persona-chars', type=int, default=600)
+    parser.add_argument('--legacy-max', type=int, default=100000, help='largest table the legacy method runs on')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_clones in args.sizes:
+            path = os.path.join(tmp, f'bench_{n_clones}.db')
+            start = time.perf_counter()
+            build(path, n_clones, args.persona_chars)
+            print(f'built {n_clones} clones in {time.perf_counter() - start:.1f} s', flush=True)
+            bench(path, n_clones, args.runs, args.legacy_max)
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
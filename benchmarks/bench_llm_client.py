@@ -0,0 +1,73 @@
+# benchmarks/bench_llm_client.py
+# Per-call client overhead: building a new model/client for every call (old behaviour) vs the
+# shared clients from llm_client.py.
+#
+#   python benchmarks/bench_llm_client.py            # construction overhead only, no network
+#   python benchmarks/bench_llm_client.py --live 10  # also time real calls (needs API keys)
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google.generativeai as genai
+
+import llm_client
+from llm import MODEL_NAME
+
+
+def timed(func, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f'{label:<42} mean {statistics.mean(samples):8.3f} ms   p50 {statistics.median(samples):8.3f} ms   p95 {p95:8.3f} ms')
+
+
+def per_call_gemini():
+    # What every llm.py function used to do (configure ran once, at import)
+    return genai.GenerativeModel(MODEL_NAME)
+
+
+def per_call_groq():
+    # What gpt_wrapper did at import time, if it were done per call
+    from groq import Groq
+    return Groq(api_key=os.getenv('GROQ_API_KEY', 'bench'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=500, help='iterations for construction overhead')
+    parser.add_argument('--live', type=int, default=0, help='also make this many real Gemini calls each way')
+    args = parser.parse_args()
+    os.environ.setdefault('GROQ_API_KEY', 'bench')
+    genai.configure(api_key=os.getenv('GOOGLE_API_KEY', 'bench'))
+
+    print(f'Client construction overhead ({args.n} iterations)')
+    report('gemini: GenerativeModel per call', timed(per_call_gemini, args.n))
+    report('gemini: llm_client.get_gemini_model', timed(lambda: llm_client.get_gemini_model(MODEL_NAME), args.n))
+    try:
+        report('groq: Groq() per call', timed(per_call_groq, args.n))
+        report('groq: llm_client.get_groq_client', timed(llm_client.get_groq_client, args.n))
+    except ImportError:
+        print('groq not installed; skipping')
+
+    if args.live:
+        prompt = 'Reply with the single word: ok'
+        print(f'\nLive Gemini calls ({args.live} each; includes connection setup on fresh clients)')
+        report('per-call model', timed(lambda: per_call_gemini().generate_content(prompt), args.live))
+        report('shared model', timed(lambda: llm_client.get_gemini_model(MODEL_NAME).generate_content(prompt), args.live))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# benchmarks/bench_sqlite.py
+# Read/write throughput on users.db-shaped data under concurrent worker processes:
+# a connection per query with default settings (old behaviour) vs db.py's reused, WAL-mode
+# connections with tuned pragmas.
+#
+#   python benchmarks/bench_sqlite.py                      # 4 readers, 2 writers, 5 s per mode
+#   python benchmarks/bench_sqlite.py -r 8 -w 4 -d 10 --clones 20000
+#
+# Readers run date_clones' queries (own clone, every candidate vector, top-5 details); writers
+# replace a clone like create_clone (DELETE + INSERT in one transaction). Both modes wait up to
+# db.BUSY_TIMEOUT for a lock, so only the connection handling and pragmas differ. Each mode gets a
+# fresh database in a temp directory, so users.db is never touched.
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from prefilter import LIKERT_QUESTIONS, encode_answers
+
+
+def random_answers(rng):
+    # The questions' own option labels, so encode_answers produces real (non-empty) vectors
+    return {q['id']: rng.choice(q['options']) for q in LIKERT_QUESTIONS}
+
+
+def build(path, n_clones):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password_hash TEXT);
+        CREATE TABLE clones (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, answers_json TEXT, text_path TEXT,
+                             persona TEXT, profile_pic_path TEXT, name TEXT, answers_vec BLOB,
+                             persona_status TEXT NOT NULL DEFAULT 'pending');
+    ''')
+    rng = random.Random(0)
+    persona = 'A persona paragraph. ' * 40
+    conn.executemany('INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+                     [(i, f'user{i}', 'x' * 100) for i in range(1, n_clones + 1)])
+    rows = []
+    for i in range(1, n_clones + 1):
+        answers = random_answers(rng)
+        rows.append((i, json.dumps(answers), persona, f'uploads/{i}.png', f'Clone {i}', encode_answers(answers)))
+    conn.executemany('''
+        INSERT INTO clones (user_id, answers_json, persona, profile_pic_path, name, answers_vec, persona_status)
+        VALUES (?, ?, ?, ?, ?, ?, 'ready')
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def read_once(conn, user_id):
+    cursor = conn.cursor()
+    cursor.execute('SELECT answers_json, persona, name, answers_vec, id, persona_status FROM clones WHERE user_id = ?',
+                   (user_id,))
+    cursor.fetchone()
+    cursor.execute("SELECT id, answers_vec FROM clones WHERE user_id != ? AND persona_status = 'ready'", (user_id,))
+    ids = [row[0] for row in cursor.fetchall()[:5]]
+    cursor.execute(f'''
+        SELECT c.id, u.username, c.answers_json, c.persona, c.profile_pic_path, c.name
+        FROM clones c JOIN users u ON c.user_id = u.id WHERE c.id IN ({','.join('?' * len(ids))})
+    ''', ids)
+    cursor.fetchall()
+
+
+def write_once(conn, user_id, rng):
+    answers = random_answers(rng)
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM clones WHERE user_id = ?', (user_id,))
+    cursor.execute('''
+        INSERT INTO clones (user_id, answers_json, persona, profile_pic_path, name, answers_vec, persona_status)
+        VALUES (?, ?, ?, ?, ?, ?, 'ready')
+    ''', (user_id, json.dumps(answers), 'A persona paragraph. ' * 40, None, 'Bench', encode_answers(answers)))
+    conn.commit()
+
+
+def worker(mode, role, path, n_clones, deadline, seed, results):
+    rng = random.Random(seed)
+    shared = db.connect(path) if mode == 'tuned' else None
+    ops = errors = 0
+    while time.time() < deadline:
+        # Old behaviour: a fresh connection with sqlite3 defaults (bar the busy timeout) for every unit of work
+        conn = shared or sqlite3.connect(path, timeout=db.BUSY_TIMEOUT)
+        user_id = rng.randint(1, n_clones)
+        try:
+            if role == 'read':
+                read_once(conn, user_id)
+            else:
+                write_once(conn, user_id, rng)
+            ops += 1
+        except sqlite3.OperationalError:  # "database is locked"
+            conn.rollback()
+            errors += 1
+        finally:
+            if shared is None:
+                conn.close()
+    results.put((role, ops, errors))
+
+
+def run(mode, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build(path, args.clones)
+        if mode == 'tuned':
+            db.connect(path).close()  # Switch the file to WAL before the workers start
+        results = multiprocessing.Queue()
+        deadline = time.time() + args.duration
+        roles = ['read'] * args.readers + ['write'] * args.writers
+        processes = [multiprocessing.Process(target=worker, args=(mode, role, path, args.clones, deadline, i, results))
+                     for i, role in enumerate(roles)]
+        for p in processes:
+            p.start()
+        totals = {'read': [0, 0], 'write': [0, 0]}
+        for _ in processes:
+            role, ops, errors = results.get()
+            totals[role][0] += ops
+            totals[role][1] += errors
+        for p in processes:
+            p.join()
+    for role, (ops, errors) in totals.items():
+        print(f'{mode:<8} {role:<6} {ops / args.duration:10.1f} ops/s   {errors:6d} locked errors')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--readers', type=int, default=4)
+    parser.add_argument('-w', '--writers', type=int, default=2)
+    parser.add_argument('-d', '--duration', type=float, default=5.0, help='seconds per mode')
+    parser.add_argument('--clones', type=int, default=5000)
+    args = parser.parse_args()
+    print(f'{args.readers} readers, {args.writers} writers, {args.clones} clones, {args.duration:g} s per mode')
+    run('default', args)
+    run('tuned', args)
+
+
+if __name__ == '__main__':
+    main()
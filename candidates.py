@@ -0,0 +1,77 @@
+# candidates.py
+# Candidate sampling for date_clones that stays cheap as the clones table grows.
+#
+# Every clone gets a random `sample_key` when it is inserted (migration 7), which fixes a shuffled
+# order of the table. A sample is a window of that order: an index range scan starting at some key
+# and wrapping around at the end, so it costs O(log N + window) no matter how many clones exist.
+# Ranking scores only the window's answer vectors (read from the covering index), and the heavy
+# columns (persona, answers) are fetched for the final K rows alone.
+#
+# With fewer ready clones than the window, the window is the whole table and the ranking is exact.
+
+import random
+
+from models import Answer
+from prefilter import decode_vectors, top_k
+
+DEFAULT_POOL = 5000  # Candidates scored per page view
+
+KEY_MIN = -2 ** 63  # sample_key is SQLite's random(): a signed 64-bit integer
+
+
+def start_key(seed=None):
+    """Where a viewer's window starts; the same seed (e.g. their clone id) always gives the same window."""
+    return random.Random(seed).randint(KEY_MIN, 2 ** 63 - 1)
+
+
+def sample_window(cursor, exclude_user_id, size, seed=None):
+    """[(clone id, answers_vec)] for up to `size` ready clones, taken in shuffled order from start_key(seed)."""
+    start = start_key(seed)
+    query = '''
+        SELECT id, answers_vec FROM clones
+        WHERE persona_status = 'ready' AND sample_key {op} ? AND user_id != ?
+        ORDER BY sample_key
+        LIMIT ?
+    '''
+    cursor.execute(query.format(op='>='), (start, exclude_user_id, size))
+    rows = cursor.fetchall()
+    if len(rows) < size:
+        # Wrap around to the beginning of the order
+        cursor.execute(query.format(op='<'), (start, exclude_user_id, size - len(rows)))
+        rows += cursor.fetchall()
+    return rows
+
+
+def random_candidates(cursor, exclude_user_id, k, seed=None):
+    """Ids of `k` random ready clones (a uniformly random window of the shuffled order when seed is None)."""
+    return [clone_id for clone_id, _ in sample_window(cursor, exclude_user_id, k, seed)]
+
+
+def ranked_candidates(cursor, viewer_vec, exclude_user_id, k, pool=DEFAULT_POOL, seed=None):
+    """Ids of the `k` clones in a `pool`-sized window most similar to `viewer_vec`, best first."""
+    rows = sample_window(cursor, exclude_user_id, pool, seed)
+    best = top_k(viewer_vec, decode_vectors([vec for _, vec in rows]), k)
+    return [rows[i][0] for i in best]
+
+
+def load_candidates(cursor, clone_ids):
+    """Candidate dicts (with persona and answers) for `clone_ids`, in the same order."""
+    if not clone_ids:
+        return []
+    cursor.execute(f'''
+        SELECT c.id, c.version, u.username, c.persona, c.profile_pic_path, c.name
+        FROM clones c
+        JOIN users u ON c.user_id = u.id
+        WHERE c.id IN ({','.join('?' * len(clone_ids))})
+    ''', clone_ids)
+    by_id = {row[0]: row for row in cursor.fetchall()}
+    answers = Answer.for_clones(cursor, by_id)
+    return [{
+        'id': clone_id,
+        'version': version,
+        'username': username,
+        'answers': answers[clone_id],
+        'persona': persona,
+        'profile_pic': profile_pic_path,
+        'name': name or 'No_Name'
+    } for clone_id, version, username, persona, profile_pic_path, name in (by_id[i] for i in clone_ids if i in by_id)]
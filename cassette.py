@@ -0,0 +1,145 @@
+# cassette.py
+# Record/replay of LLM calls for reproducible benchmarks and regression tests of the matching
+# pipeline. Cassettes are JSONL, one request/response pair per line (same convention as
+# requests.jsonl).
+#
+#   LLM_CASSETTE_MODE=record   call the real (or fake) provider and append every call to the cassette
+#   LLM_CASSETTE_MODE=replay   serve responses from the cassette, no network access needed
+#   LLM_CASSETTE_PATH          cassette file (default cassettes/llm.jsonl)
+#   LLM_CASSETTE_TIME_SCALE    replay timing: 1 = original latency, 0.5 = twice as fast, 0 = instant
+#
+# The llm_cache is bypassed during replay so every call is served (and timed) from the cassette.
+
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import llm_cache
+from llm_client import Completion, estimate_tokens
+
+CASSETTE_PATH = os.getenv('LLM_CASSETTE_PATH', os.path.join('cassettes', 'llm.jsonl'))
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+def request_key(provider_name, model, prompt=None, messages=None, temperature=None, max_tokens=None,
+                generation_config=None):
+    return llm_cache.make_key(provider_name, model, prompt=prompt, messages=messages, temperature=temperature,
+                              max_tokens=max_tokens, generation_config=generation_config)
+
+
+def load(path=CASSETTE_PATH):
+    """Recorded calls grouped by request key, in recording order."""
+    records = defaultdict(deque)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records[record['key']].append(record)
+    return records
+
+
+class CassetteProvider:
+    """Wraps a provider to record its calls to, or replay them from, a JSONL cassette."""
+
+    def __init__(self, inner, mode, path=CASSETTE_PATH, time_scale=None):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'Unknown LLM_CASSETTE_MODE: {mode!r}')
+        self.inner = inner
+        self.name = inner.name  # Keys (and llm_cache entries) stay those of the wrapped provider
+        self.mode = mode
+        self.path = path
+        self.time_scale = float(os.getenv('LLM_CASSETTE_TIME_SCALE', 1.0)) if time_scale is None else time_scale
+        self._lock = threading.Lock()
+        self._records = load(path) if mode == 'replay' else None
+
+    # =========================
+    # Provider interface
+    # =========================
+    def complete(self, call_type, model, prompt=None, messages=None, temperature=None, max_tokens=None,
+                 generation_config=None):
+        key = request_key(self.name, model, prompt, messages, temperature, max_tokens, generation_config)
+        if self.mode == 'replay':
+            record = self._next(key, call_type)
+            time.sleep(record['latency_ms'] / 1000.0 * self.time_scale)
+            return Completion(record['response'], record.get('prompt_tokens'), record.get('completion_tokens'))
+
+        start = time.perf_counter()
+        result = self.inner.complete(call_type, model, prompt=prompt, messages=messages, temperature=temperature,
+                                     max_tokens=max_tokens, generation_config=generation_config)
+        self._append(key, call_type, model, prompt, messages, temperature, max_tokens, generation_config,
+                     result.text, (time.perf_counter() - start) * 1000, None,
+                     result.prompt_tokens, result.completion_tokens)
+        return result
+
+    def stream(self, call_type, model, prompt=None, messages=None, temperature=None, max_tokens=None):
+        key = request_key(self.name, model, prompt, messages, temperature, max_tokens)
+        if self.mode == 'replay':
+            record = self._next(key, call_type)
+            # First line after the recorded time to first token, the rest spread over the remainder
+            lines = record['response'].split('\n')
+            first = record.get('first_chunk_ms') or record['latency_ms']
+            time.sleep(first / 1000.0 * self.time_scale)
+            gap = max(0.0, record['latency_ms'] - first) / max(1, len(lines) - 1) / 1000.0 * self.time_scale
+            for i, line in enumerate(lines):
+                if i:
+                    time.sleep(gap)
+                yield line + ('\n' if i < len(lines) - 1 else '')
+            return
+
+        start = time.perf_counter()
+        first_chunk_ms = None
+        chunks = []
+        for chunk in self.inner.stream(call_type, model, prompt=prompt, messages=messages, temperature=temperature,
+                                       max_tokens=max_tokens):
+            if first_chunk_ms is None:
+                first_chunk_ms = (time.perf_counter() - start) * 1000
+            chunks.append(chunk)
+            yield chunk
+        text = ''.join(chunks)
+        self._append(key, call_type, model, prompt, messages, temperature, max_tokens, None,
+                     text, (time.perf_counter() - start) * 1000, first_chunk_ms,
+                     estimate_tokens(prompt if prompt is not None else json.dumps(messages)), estimate_tokens(text))
+
+    # =========================
+    # Cassette file
+    # =========================
+    def _next(self, key, call_type):
+        with self._lock:
+            queue = self._records.get(key)
+            if not queue:
+                raise CassetteMiss(f'No recorded {call_type} call for key {key[:12]} in {self.path}')
+            # Identical requests replay in recording order; the last one repeats once exhausted
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def _append(self, key, call_type, model, prompt, messages, temperature, max_tokens, generation_config,
+                response, latency_ms, first_chunk_ms, prompt_tokens, completion_tokens):
+        record = {
+            'key': key,
+            'provider': self.name,
+            'model': model,
+            'call_type': call_type,
+            'request': {'prompt': prompt, 'messages': messages, 'temperature': temperature,
+                        'max_tokens': max_tokens, 'generation_config': generation_config},
+            'response': response,
+            'latency_ms': round(latency_ms, 1),
+            'first_chunk_ms': round(first_chunk_ms, 1) if first_chunk_ms is not None else None,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'recorded_at': time.time(),
+        }
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                # Workers in other processes append to the same cassette
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(line)
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
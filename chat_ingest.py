@@ -0,0 +1,192 @@
+# chat_ingest.py
+# Streaming ingestion of uploaded chat exports for persona generation.
+#
+# The file is read once, line by line, in constant memory (no matter how large the export is):
+# texting-style statistics are accumulated on the fly and a small, diverse sample of messages is
+# kept with stratified reservoir sampling (one reservoir per message-length bucket). Only the
+# compact summary from summarize() goes into the persona prompt.
+
+import random
+import re
+from collections import Counter
+
+MAX_LINE_CHARS = 4096  # Longer lines are read in pieces so one huge line can't blow up memory
+SAMPLE_PER_BUCKET = 4
+SAMPLE_MAX_CHARS = 200
+SEED = 0  # Fixed, so the same file always gives the same summary (and the same cached prompt)
+
+# Word-count buckets used for both the length distribution and the stratified sample
+LENGTH_BUCKETS = [(1, 3, 'very short'), (4, 10, 'short'), (11, 25, 'medium'), (26, None, 'long')]
+
+SLANG = {'lol', 'lmao', 'lmfao', 'rofl', 'omg', 'idk', 'tbh', 'imo', 'imho', 'btw', 'brb', 'ttyl', 'smh', 'fr',
+         'ngl', 'rn', 'u', 'ur', 'ya', 'yea', 'yeah', 'nah', 'gonna', 'wanna', 'gotta', 'kinda', 'sorta', 'haha',
+         'hahaha', 'hehe', 'thx', 'pls', 'plz', 'bc', 'cuz', 'tho', 'k', 'kk', 'ok', 'np', 'bruh', 'dude', 'lowkey',
+         'highkey', 'bet', 'sus', 'af', 'irl', 'jk', 'xd', 'xo', 'xoxo', 'omw', 'wyd', 'hbu', 'ily', 'nvm'}
+
+EMOJI_RE = re.compile('[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF]')
+EMOTICON_RE = re.compile(r'(?:^|\s)(?:[:;=8][\-o\*\']?[\)\]\(\[dDpP/\\|]|<3|\^_\^|xD)(?=\s|$)')
+WORD_RE = re.compile(r"[A-Za-z']+")
+LETTER_RE = re.compile(r'[^\W\d_]')
+SHOUT_RE = re.compile(r'\b[A-Z]{3,}\b')
+
+# "[12/01/2023, 10:15:32] Name: text", "12/01/23, 10:15 - Name: text", "2023-01-12 10:15 Name: text"
+PREFIX_RE = re.compile(
+    r'^\[?\d{1,4}[./-]\d{1,2}[./-]\d{1,4},?\s+\d{1,2}:\d{2}(?::\d{2})?\s*(?:[AaPp]\.?[Mm]\.?)?\]?\s*(?:-\s*)?'
+)
+SENDER_RE = re.compile(r'^([^:]{1,40}):\s+')
+# Export headers and system lines (matched against the lowercased message)
+SKIP_PHRASES = ('end-to-end encrypted', 'omitted>', 'image omitted', 'video omitted', 'sticker omitted',
+                'audio omitted', 'this message was deleted', 'missed voice call', 'missed video call',
+                'created group', 'added you', 'changed the subject')
+SKIP_PREFIXES = ('whatsapp chat with', 'messages to ', 'messages from ', 'message to ', 'message from ')
+
+
+def _bucket(words):
+    for i, (low, high, _) in enumerate(LENGTH_BUCKETS):
+        if words >= low and (high is None or words <= high):
+            return i
+    return 0
+
+
+def clean_message(line):
+    """Strip export timestamps and sender names; returns None for headers and system lines."""
+    line = line.strip().lstrip('\ufeff\u200e')
+    if not line:
+        return None
+    line, stamped = PREFIX_RE.subn('', line, count=1)
+    sender = SENDER_RE.match(line)
+    if sender and (stamped or len(sender.group(1).split()) <= 3):
+        line = line[sender.end():]
+    line = line.strip()
+    lower = line.lower()
+    if not line or lower.startswith(SKIP_PREFIXES) or any(phrase in lower for phrase in SKIP_PHRASES):
+        return None
+    return line
+
+
+class StyleStats:
+    """Texting-style statistics accumulated one message at a time."""
+
+    def __init__(self, seed=SEED):
+        self.messages = 0
+        self.words = 0
+        self.bucket_counts = [0] * len(LENGTH_BUCKETS)
+        self.with_emoji = 0
+        self.emojis = Counter()
+        self.with_emoticon = 0
+        self.with_slang = 0
+        self.slang = Counter()
+        self.all_lowercase = 0
+        self.capitalized = 0
+        self.shouting = 0
+        self.endings = Counter()  # '.', '!', '?', '...', or '' for none
+        self.multi_punct = 0
+        self.questions = 0
+        self._rng = random.Random(seed)
+        self._seen = [0] * len(LENGTH_BUCKETS)
+        self._samples = [[] for _ in LENGTH_BUCKETS]
+
+    def add(self, message):
+        n_words = max(1, len(message.split()))
+        bucket = _bucket(n_words)
+        self.messages += 1
+        self.words += n_words
+        self.bucket_counts[bucket] += 1
+
+        emojis = EMOJI_RE.findall(message)
+        if emojis:
+            self.with_emoji += 1
+            self.emojis.update(emojis)
+        if EMOTICON_RE.search(message):
+            self.with_emoticon += 1
+        slang = [t for t in WORD_RE.findall(message.lower()) if t in SLANG]
+        if slang:
+            self.with_slang += 1
+            self.slang.update(slang)
+
+        if message.islower():
+            self.all_lowercase += 1
+        first_letter = LETTER_RE.search(message)
+        if first_letter and first_letter.group().isupper():
+            self.capitalized += 1
+        if SHOUT_RE.search(message):
+            self.shouting += 1
+
+        stripped = EMOJI_RE.sub('', message).rstrip()
+        if stripped.endswith('...') or stripped.endswith('…'):
+            self.endings['...'] += 1
+        elif stripped[-1:] in ('.', '!', '?'):
+            self.endings[stripped[-1]] += 1
+        else:
+            self.endings[''] += 1
+        if '!!' in message or '??' in message or '?!' in message:
+            self.multi_punct += 1
+        if '?' in message:
+            self.questions += 1
+
+        self._sample(bucket, message)
+
+    def _sample(self, bucket, message):
+        # Reservoir sampling (Algorithm R) within each length bucket
+        message = message[:SAMPLE_MAX_CHARS]
+        self._seen[bucket] += 1
+        reservoir = self._samples[bucket]
+        if message in reservoir:
+            return
+        if len(reservoir) < SAMPLE_PER_BUCKET:
+            reservoir.append(message)
+        else:
+            j = self._rng.randrange(self._seen[bucket])
+            if j < SAMPLE_PER_BUCKET:
+                reservoir[j] = message
+
+    def samples(self, limit=12):
+        """Up to `limit` sampled messages, spread across length buckets in proportion to how common each is."""
+        picked = []
+        order = sorted(range(len(LENGTH_BUCKETS)), key=lambda i: -self.bucket_counts[i])
+        for i in order:
+            share = max(1, round(limit * self.bucket_counts[i] / max(1, self.messages))) if self.bucket_counts[i] else 0
+            picked.extend(self._samples[i][:share])
+        return picked[:limit]
+
+
+def ingest(path):
+    """Read a chat export in one streaming pass and return its StyleStats."""
+    stats = StyleStats()
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in iter(lambda: f.readline(MAX_LINE_CHARS), ''):
+            message = clean_message(line)
+            if message:
+                stats.add(message)
+    return stats
+
+
+def _pct(count, total):
+    return f'{round(100 * count / total)}%'
+
+
+def summarize(path, sample_size=12):
+    """Compact texting-style summary of a chat export, for the persona prompt."""
+    stats = ingest(path)
+    n = stats.messages
+    if not n:
+        return 'No readable messages in the texting sample.'
+    lengths = ', '.join(f'{label} {_pct(count, n)}' for (_, _, label), count in zip(LENGTH_BUCKETS, stats.bucket_counts))
+    endings = ', '.join(f'{"no punctuation" if end == "" else repr(end)} {_pct(count, n)}'
+                        for end, count in stats.endings.most_common(3))
+    lines = [
+        f'Texting style statistics (from {n} messages):',
+        f'- Message length: {stats.words / n:.1f} words on average ({lengths})',
+        f'- Emoji in {_pct(stats.with_emoji, n)} of messages'
+        + (f', favorites: {" ".join(e for e, _ in stats.emojis.most_common(5))}' if stats.emojis else '')
+        + f'; text emoticons like :) in {_pct(stats.with_emoticon, n)}',
+        f'- Slang/abbreviations in {_pct(stats.with_slang, n)} of messages'
+        + (f', most used: {", ".join(s for s, _ in stats.slang.most_common(6))}' if stats.slang else ''),
+        f'- Casing: all lowercase {_pct(stats.all_lowercase, n)}, starts with a capital {_pct(stats.capitalized, n)}, '
+        f'ALL-CAPS words {_pct(stats.shouting, n)}',
+        f'- Message endings: {endings}; repeated !!/?? in {_pct(stats.multi_punct, n)}',
+        f'- Asks questions in {_pct(stats.questions, n)} of messages',
+        'Representative messages:',
+    ]
+    lines.extend(f'- {message}' for message in stats.samples(sample_size))
+    return '\n'.join(lines)
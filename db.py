@@ -0,0 +1,85 @@
+# db.py
+# SQLite access for users.db: one tuned connection per request (Flask app context) or per thread.
+#
+# Opening a connection costs a file open, schema parse and pragma setup, and the statement cache
+# lives on the connection, so connections are reused instead of opened per query:
+#   - in a request, get_db() returns the same connection until the app context is torn down
+#   - elsewhere (job workers, pool threads, scripts), each thread keeps its own connection
+# WAL lets readers (date_clones) run while a writer (create_clone, workers) commits, and
+# busy_timeout makes a second writer wait for the lock instead of failing with "database is locked".
+
+import os
+import sqlite3
+import threading
+
+from flask import appcontext_pushed, g, has_app_context
+
+from tracing import TracedConnection
+
+DB_PATH = 'users.db'
+BUSY_TIMEOUT = 30.0  # Seconds a writer waits for the write lock
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection (sqlite3 default: 128)
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',  # Persistent: stored in the database file
+    'PRAGMA synchronous = NORMAL',  # Safe with WAL; only fsyncs at checkpoints
+    'PRAGMA mmap_size = 268435456',  # Read pages through a 256 MB memory map
+    'PRAGMA cache_size = -32000',  # 32 MB page cache per connection
+    'PRAGMA temp_store = MEMORY',
+)
+
+_local = threading.local()
+
+
+def connect(path=DB_PATH, autocommit=False):
+    """
+    A new tuned connection. With `autocommit`, statements run outside implicit transactions
+    (isolation_level=None) and the caller manages BEGIN/COMMIT itself.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None if autocommit else '',
+                           cached_statements=STATEMENT_CACHE_SIZE, factory=TracedConnection)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def thread_db(autocommit=False):
+    """This thread's long-lived connection (recreated after a fork, since connections can't be shared)."""
+    key = 'autocommit' if autocommit else 'default'
+    conns = getattr(_local, 'conns', None)
+    if conns is None or _local.pid != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+    conn = conns.get(key)
+    if conn is None:
+        conn = conns[key] = connect(autocommit=autocommit)
+    return conn
+
+
+def get_db():
+    """The current request's connection, or this thread's outside a request."""
+    # Pool threads run with a copy of the request's context (see matching.py), even after the request
+    # has been torn down, so `g` is only used on the thread that pushed the app context
+    if has_app_context() and g.get('_db_owner') == threading.get_ident():
+        if '_db' not in g:
+            g._db = connect()
+        return g._db
+    return thread_db()
+
+
+def _claim_db(sender, **extra):
+    g._db_owner = threading.get_ident()
+
+
+def close_db(exception=None):
+    # Uncommitted changes (a request that failed half-way) are rolled back by close()
+    conn = g.pop('_db', None)
+    g.pop('_db_owner', None)  # Copies of this context left in pool threads fall back to thread_db()
+    if conn is not None:
+        conn.close()
+
+
+def init_app(app):
+    """Give each app context its own connection, owned by the thread that pushed it."""
+    appcontext_pushed.connect(_claim_db, app)
+    app.teardown_appcontext(close_db)
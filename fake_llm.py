@@ -0,0 +1,145 @@
+# fake_llm.py
+# Deterministic offline LLM backend for load testing (LLM_BACKEND=fake).
+#
+# Responses are derived from a hash of the request, so the same prompt always gets the same
+# answer, and are shaped like the real ones: persona text (new or patched), 20-line conversations, scores,
+# the combined evaluation JSON, gpt_wrapper clone turns and summary JSON.
+#
+# Latency is set with FAKE_LLM_LATENCY:
+#   fixed:0.8            every call takes 0.8 s (default fixed:0)
+#   lognormal:0.0,0.5    exp(N(mu, sigma)) seconds, i.e. median e^mu with a long right tail
+#   replay:latencies.txt draw from recorded samples: one number (seconds) per line, or JSONL
+#                        records with a "latency_ms" field (e.g. an LLM cassette)
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from llm_client import Completion, estimate_tokens
+
+OPENERS = [
+    "Are you a parking ticket? Because you've got fine written all over you",
+    "Hey! Your profile says you love hiking, favorite trail?",
+    "Okay important question: pineapple on pizza, yes or no?",
+    "Hi there, what's the best thing that happened to you this week?",
+]
+LINES = [
+    "Haha that's amazing, tell me more",
+    "Honestly I'm more of a stay-in-and-cook kind of person",
+    "No way, I love that too!",
+    "Hmm I'm not sure we'd agree on that one lol",
+    "What do you usually do on weekends?",
+    "I've been getting into rock climbing lately",
+    "That sounds like a perfect Sunday to me",
+    "Wait, you've been to Japan?? I'm so jealous",
+    "I'm a sucker for a good documentary",
+    "Dogs or cats? This is a dealbreaker question",
+    "Haha fair enough, I respect the honesty",
+    "I think we'd get along really well",
+]
+TRAITS = ['playful', 'curious', 'laid-back', 'witty', 'thoughtful', 'adventurous', 'warm', 'sarcastic']
+STYLES = ['short texts with lots of emojis', 'long thoughtful paragraphs', 'lowercase and slang',
+          'proper punctuation and the occasional pun']
+
+
+def _parse_latency(spec):
+    kind, _, arg = (spec or 'fixed:0').partition(':')
+    if kind == 'fixed':
+        value = float(arg or 0)
+        return lambda rng: value
+    if kind == 'lognormal':
+        mu, sigma = (float(x) for x in (arg or '0,0.5').split(','))
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    if kind == 'replay':
+        samples = []
+        with open(arg, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith('{'):
+                    record = json.loads(line)
+                    if 'latency_ms' in record:
+                        samples.append(record['latency_ms'] / 1000.0)
+                else:
+                    samples.append(float(line))
+        if not samples:
+            raise ValueError(f'No latency samples in {arg}')
+        return lambda rng: rng.choice(samples)
+    raise ValueError(f'Unknown FAKE_LLM_LATENCY: {spec!r}')
+
+
+class FakeProvider:
+    name = 'fake'
+
+    def __init__(self):
+        self._latency = _parse_latency(os.getenv('FAKE_LLM_LATENCY'))
+        self._rng = random.Random(os.getenv('FAKE_LLM_SEED', 0))
+        self._rng_lock = threading.Lock()
+
+    def _sample_latency(self):
+        with self._rng_lock:
+            return max(0.0, self._latency(self._rng))
+
+    def complete(self, call_type, model, prompt=None, messages=None, temperature=None, max_tokens=None,
+                 generation_config=None):
+        time.sleep(self._sample_latency())
+        text = self._respond(call_type, prompt, messages)
+        return Completion(text, estimate_tokens(prompt if prompt is not None else json.dumps(messages)),
+                          estimate_tokens(text))
+
+    def stream(self, call_type, model, prompt=None, messages=None, temperature=None, max_tokens=None):
+        # Roughly a third of the latency is time to first token, the rest spread over the lines
+        latency = self._sample_latency()
+        lines = self._respond(call_type, prompt, messages).split('\n')
+        time.sleep(latency * 0.3)
+        for i, line in enumerate(lines):
+            if i:
+                time.sleep(latency * 0.7 / max(1, len(lines) - 1))
+            yield line + ('\n' if i < len(lines) - 1 else '')
+
+    # =========================
+    # Responses
+    # =========================
+    def _respond(self, call_type, prompt, messages):
+        text = prompt if prompt is not None else json.dumps(messages, sort_keys=True)
+        rng = random.Random(hashlib.sha256(f'{call_type}\n{text}'.encode('utf-8')).hexdigest())
+        if call_type in ('persona', 'persona_patch'):
+            return self._persona(rng)
+        if call_type == 'conversation':
+            return '\n'.join(f'{who}: {msg}' for who, msg in self._turns(rng, text))
+        if call_type == 'compatibility':
+            return f'Compatibility score: {rng.randint(1, 100)}/100'
+        if call_type == 'evaluation':
+            turns = [{'speaker': who, 'text': msg} for who, msg in self._turns(rng, text)]
+            return json.dumps({'turns': turns, 'score': rng.randint(1, 100)})
+        if call_type == 'summary':
+            return json.dumps({
+                'compatibility_score': rng.randint(1, 100),
+                'highlights': rng.sample(['shared love of music', 'similar humor', 'both outdoorsy',
+                                          'matching energy'], 2),
+                'evidence_tags': rng.sample(['music', 'coffee', 'outdoors', 'books', 'food'], 2),
+                'red_flags': [],
+                'next_step': 'Swap favorite albums and compare notes.',
+            })
+        # clone_turn and anything else: one short chat message
+        return rng.choice(LINES)
+
+    def _persona(self, rng):
+        traits = rng.sample(TRAITS, 3)
+        return (f"{traits[0].capitalize()}, {traits[1]} and {traits[2]} dater who texts in {rng.choice(STYLES)}. "
+                f"Loves {rng.choice(['hiking', 'cooking', 'live music', 'board games', 'travel'])} and asks a lot of "
+                f"follow-up questions. Tone: {rng.choice(['flirty', 'friendly', 'dry', 'earnest'])}.")
+
+    def _turns(self, rng, prompt):
+        user = re.search(r'User bot \(named (.*?)\)', prompt)
+        other = re.search(r'Other bot \(named (.*?)\)', prompt)
+        names = [user.group(1) if user else 'You', other.group(1) if other else 'Them']
+        turns = [(names[0], rng.choice(OPENERS))]
+        for i in range(1, 20):
+            turns.append((names[i % 2], rng.choice(LINES)))
+        return turns
@@ -0,0 +1,34 @@
+# fingerprint.py
+# Fingerprints of the inputs a clone's persona is generated from, so create_clone can tell
+# whether anything actually changed since the last generation.
+
+import hashlib
+import json
+
+
+def normalize_answer(answer):
+    # Whitespace differences don't change what the persona is built from
+    if answer is None:
+        return None
+    answer = ' '.join(str(answer).split())
+    return answer or None
+
+
+def normalize_answers(answers):
+    return {q_id: normalize_answer(answer) for q_id, answer in answers.items() if normalize_answer(answer)}
+
+
+def clone_fingerprint(answers, name, text_hash):
+    payload = json.dumps({
+        'answers': normalize_answers(answers),
+        'name': normalize_answer(name),
+        'text_hash': text_hash,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def changed_answers(old_answers, new_answers):
+    """{question id: (old, new)} for every answer that differs after normalization."""
+    old, new = normalize_answers(old_answers), normalize_answers(new_answers)
+    return {q_id: (old.get(q_id), new.get(q_id)) for q_id in sorted(set(old) | set(new))
+            if old.get(q_id) != new.get(q_id)}
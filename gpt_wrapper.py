@@ -1,14 +1,14 @@
 import os, json, re, sys, pathlib
 from collections import Counter
-from groq import Groq
+import llm_cache
+import metrics
+from llm_client import get_provider
 
 # =========================
 # 0) Config & Client Setup
 # =========================
-# export GROQ_API_KEY=... (set in your shell)
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise RuntimeError("Missing GROQ_API_KEY env var. `export GROQ_API_KEY=...`")
+# export GROQ_API_KEY=... (set in your shell); checked when the first call needs the client
+# (or LLM_BACKEND=fake to run fully offline, see fake_llm.py)
 
 # Pick a Groq model you have access to. Examples:
 #   "llama-3.1-70b-versatile"  (good general)
@@ -16,8 +16,6 @@ if not GROQ_API_KEY:
 #   "llama3-70b-8192"
 DEFAULT_MODEL = os.environ.get("GROQ_MODEL", "llama-3.3-70b-versatile")
 
-client = Groq(api_key=GROQ_API_KEY)
-
 # Persisted lightweight memory store (do NOT commit this file)
 MEM_PATH = pathlib.Path(__file__).with_name("user_mem.json")
 
@@ -114,14 +112,18 @@ def build_system_prompt(user_id, goal="Gauge compatibility only. DO NOT plan dat
 # =============================
 # 5) One model call helper
 # =============================
-def llm(messages, model=DEFAULT_MODEL, temperature=0.6, max_tokens=300):
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        messages=messages
-    )
-    return resp.choices[0].message.content.strip()
+def llm(messages, model=DEFAULT_MODEL, temperature=0.6, max_tokens=300, call_type="clone_turn"):
+    # Identical requests are served from the shared llm_cache (opt out per call_type via LLM_CACHE_DISABLE)
+    provider = get_provider("groq")
+    key = llm_cache.make_key(provider.name, model, messages=messages, temperature=temperature, max_tokens=max_tokens)
+
+    with metrics.llm_call(call_type, provider.name, model) as call:
+        def compute():
+            result = provider.complete(call_type, model, messages=messages, temperature=temperature, max_tokens=max_tokens)
+            call.set_usage(result)
+            return result.text
+
+        return llm_cache.cached_call(call_type, key, compute)
 
 
 # ===========================================
@@ -298,6 +300,7 @@ def summarize_and_score(history, feats, model=DEFAULT_MODEL):
         model=model,
         temperature=0.1,
         max_tokens=600,
+        call_type="summary",
     )
 
     # 1) Try direct parse if it already starts with '{'
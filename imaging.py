@@ -0,0 +1,120 @@
+# imaging.py
+# Profile picture compositing: the user's photo is pasted into the robot's head (static/robot.png).
+#
+# Uploads are composited straight from their bytes, by a composite_profile_pic job on worker.py
+# (see tasks.py), or inline without the job queue. Each process decodes the robot template and head
+# mask once. Composites are saved in the content-addressed upload store (storage.py). Alongside each one,
+# smaller WebP (and AVIF, where Pillow supports it) derivatives are written for srcset:
+# ab/ab12...ef.png -> ab/ab12...ef.w320.webp, ab/ab12...ef.w320.avif, ...
+
+import io
+import logging
+import os
+import threading
+
+from PIL import Image, ImageChops, features
+
+from storage import store_bytes, write_once
+
+logger = logging.getLogger(__name__)
+
+ROBOT_PATH = os.path.join('static', 'robot.png')
+HEAD_SIZE = (202, 167)  # Size of the head area in robot.png
+HEAD_POSITION = (187, 96)  # Top-left corner of the head area
+
+DERIVATIVE_WIDTHS = (160, 320, 500)  # Home avatar, match card, match card on 2x screens (composite is 500px)
+# (format, mime type, save options), best compression first
+DERIVATIVE_FORMATS = [fmt for fmt in [
+    ('avif', 'image/avif', {'quality': 60, 'speed': 6}),
+    ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+] if features.check(fmt[0])]
+
+_template = None
+_head_mask = None
+_template_lock = threading.Lock()
+
+
+def load_template():
+    """The decoded RGBA robot and the head-region mask, loaded once per process."""
+    global _template, _head_mask
+    with _template_lock:
+        if _template is None:
+            with Image.open(ROBOT_PATH) as robot:
+                _template = robot.convert('RGBA')
+            _head_mask = Image.new('L', HEAD_SIZE, 255)
+        return _template, _head_mask
+
+
+def composite_profile_pic(data):
+    """Composite an uploaded image (raw file bytes) onto the robot; returns the RGBA image."""
+    robot, head_mask = load_template()
+    with Image.open(io.BytesIO(data)) as user_img:
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale; ask for the smallest that still covers the head
+        user_img.draft('RGB', (HEAD_SIZE[0] * 2, HEAD_SIZE[1] * 2))
+        user_img = user_img.convert('RGBA').resize(HEAD_SIZE, Image.Resampling.LANCZOS)
+
+    mask = head_mask
+    if user_img.getextrema()[3][0] < 255:
+        mask = ImageChops.multiply(head_mask, user_img.getchannel('A'))  # Keep the upload's own transparency
+
+    composite_img = robot.copy()
+    composite_img.paste(user_img, HEAD_POSITION, mask)
+    return composite_img
+
+
+def derivative_path(path, width, fmt):
+    return f'{os.path.splitext(path)[0]}.w{width}.{fmt}'
+
+
+def write_derivatives(img, path):
+    """
+    Save every missing width/format derivative of `img` next to `path`; returns how many were written.
+    Like the composite, a derivative is served as immutable, so an existing one is never rewritten.
+    """
+    written = 0
+    for width in DERIVATIVE_WIDTHS:
+        if width > img.width:
+            continue
+        resized = img if width == img.width else img.resize(
+            (width, round(img.height * width / img.width)), Image.Resampling.LANCZOS)
+        for fmt, _, options in DERIVATIVE_FORMATS:
+            out_path = derivative_path(path, width, fmt)
+            if write_once(out_path, lambda f: resized.save(f, fmt.upper(), **options)):
+                written += 1
+    return written
+
+
+def composite_to_store(data, upload_folder):
+    """Composite an upload (raw file bytes) into a PNG in the upload store, with its derivatives; returns its path."""
+    composite_img = composite_profile_pic(data)
+    png = io.BytesIO()
+    composite_img.save(png, 'PNG')
+    out_path, _ = store_bytes(png.getvalue(), 'png', upload_folder)
+    write_derivatives(composite_img, out_path)  # Already there if this picture was stored before
+    logger.info('Saved composite image and derivatives: %s', out_path)
+    return out_path
+
+
+def backfill_derivatives(path):
+    """Generate missing derivatives for an existing composite (see backfill_thumbnails.py)."""
+    with Image.open(path) as img:
+        img.load()
+        return write_derivatives(img, path)
+
+
+def picture_sources(path):
+    """
+    [(mime type, srcset)] for the derivatives of `path` that exist, best format first.
+    The largest width is checked as a marker, since all widths are written together.
+    """
+    if not path or not path.lstrip('/').startswith('uploads/'):
+        return []
+    path = path.lstrip('/')
+    sources = []
+    for fmt, mime, _ in DERIVATIVE_FORMATS:
+        if not os.path.exists(derivative_path(path, DERIVATIVE_WIDTHS[-1], fmt)):
+            continue
+        srcset = ', '.join(f'/{derivative_path(path, width, fmt)} {width}w' for width in DERIVATIVE_WIDTHS)
+        sources.append((mime, srcset))
+    return sources
+
@@ -0,0 +1,213 @@
+# jobs.py
+# Durable SQLite-backed job queue: enqueue from Flask, claim and run from worker.py processes.
+
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+import metrics
+from db import thread_db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 300  # A claimed job is handed to another worker if its lease isn't renewed by then
+HEARTBEATS_PER_LEASE = 3  # A running job's lease is renewed this many times per lease period
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2.0  # Seconds before the first retry, doubled on each further attempt
+BACKOFF_CAP = 600.0
+
+# kind -> function(payload); filled in by the @handler decorator (see tasks.py)
+HANDLERS = {}
+# kind -> function(payload) called once a job of that kind is dead-lettered
+DEAD_HANDLERS = {}
+
+
+def handler(kind, on_dead=None):
+    def register(func):
+        HANDLERS[kind] = func
+        if on_dead is not None:
+            DEAD_HANDLERS[kind] = on_dead
+        return func
+    return register
+
+
+def init_jobs_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            priority INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_at REAL NOT NULL,
+            lease_until REAL,
+            locked_by TEXT,
+            dedupe_key TEXT,
+            last_error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Claim order: runnable jobs by priority, then by when they became due
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority DESC, run_at)')
+    # At most one live (queued or running) job per dedupe key
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key)
+        WHERE dedupe_key IS NOT NULL AND status IN ('queued', 'running')
+    ''')
+
+
+def _connect():
+    return thread_db(autocommit=True)  # Explicit transactions below
+
+
+def enqueue(kind, payload, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS, dedupe_key=None, delay=0):
+    """
+    Add a job and return its id, or None if a live job with the same `dedupe_key` exists.
+    Higher `priority` runs first.
+    """
+    cursor = _connect().execute('''
+        INSERT OR IGNORE INTO jobs (kind, payload, priority, max_attempts, run_at, dedupe_key)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (kind, json.dumps(payload), priority, max_attempts, time.time() + delay, dedupe_key))
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+def claim(worker_id, kinds=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Atomically take the next runnable job (queued and due, or running with an expired lease).
+    Returns (id, kind, payload, attempts) or None.
+
+    A job whose lease expired with no attempts left (its worker crashed or was killed each time)
+    is dead-lettered here instead of being handed out again.
+    """
+    now = time.time()
+    kind_filter = ''
+    params = [now, now]
+    if kinds:
+        kind_filter = f"AND kind IN ({','.join('?' * len(kinds))})"
+        params += list(kinds)
+    conn = _connect()
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can't pick the same row
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        dead = conn.execute('''
+            UPDATE jobs SET status = 'dead', lease_until = NULL, locked_by = NULL, updated_at = CURRENT_TIMESTAMP,
+                            last_error = 'Lease expired on the last attempt (worker crashed or was killed)'
+            WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts
+            RETURNING id, kind, payload
+        ''', (now,)).fetchall()
+        row = conn.execute(f'''
+            SELECT id, kind, payload, attempts FROM jobs
+            WHERE ((status = 'queued' AND run_at <= ?) OR (status = 'running' AND lease_until < ?))
+            {kind_filter}
+            ORDER BY priority DESC, run_at
+            LIMIT 1
+        ''', params).fetchone()
+        if row is not None:
+            conn.execute('''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, locked_by = ?,
+                                updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (now + lease_seconds, worker_id, row[0]))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    for job_id, kind, payload in dead:
+        logger.warning('Job %s (%s) dead: lease expired on its last attempt', job_id, kind)
+        if kind in DEAD_HANDLERS:
+            DEAD_HANDLERS[kind](json.loads(payload))
+    if row is None:
+        return None
+    return row[0], row[1], json.loads(row[2]), row[3] + 1
+
+
+def extend_lease(job_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Push a running job's lease forward; False if it is no longer ours (finished, or re-claimed)."""
+    cursor = _connect().execute('''
+        UPDATE jobs SET lease_until = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'running' AND locked_by = ?
+    ''', (time.time() + lease_seconds, job_id, worker_id))
+    return cursor.rowcount > 0
+
+
+def _heartbeat(job_id, worker_id, lease_seconds, stop):
+    # Keeps the lease alive while the handler runs (e.g. a persona job waiting out rate-limit
+    # backoff), so a long job isn't picked up by a second worker while the first still runs it
+    while not stop.wait(lease_seconds / HEARTBEATS_PER_LEASE):
+        try:
+            if not extend_lease(job_id, worker_id, lease_seconds):
+                return
+        except sqlite3.Error as e:
+            logger.warning('Lease renewal for job %s failed: %s', job_id, e)
+
+
+def complete(job_id, worker_id):
+    """Mark a job done; False if it is no longer ours (its lease expired and another worker took it)."""
+    cursor = _connect().execute('''
+        UPDATE jobs SET status = 'done', lease_until = NULL, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'running' AND locked_by = ?
+    ''', (job_id, worker_id))
+    return cursor.rowcount > 0
+
+
+def fail(job_id, worker_id, attempts, error):
+    """
+    Schedule a retry with exponential backoff and jitter, or dead-letter after max_attempts.
+    Returns True if the job is now dead. A job that is no longer ours is left to its new owner.
+    """
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+    conn = _connect()
+    row = conn.execute('''
+        UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+                        run_at = ?, lease_until = NULL, locked_by = NULL, last_error = ?,
+                        updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'running' AND locked_by = ?
+        RETURNING status
+    ''', (time.time() + delay, error, job_id, worker_id)).fetchone()
+    return row is not None and row[0] == 'dead'
+
+
+def run_job(job_id, kind, payload, attempts, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Run a job claimed by `worker_id`; its lease is renewed in the background until it finishes."""
+    token = metrics.set_route(f'job:{kind}')
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, worker_id, lease_seconds, stop), daemon=True,
+                     name=f'heartbeat-{job_id}').start()
+    try:
+        HANDLERS[kind](payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.error('Job %s (%s) failed on attempt %s:\n%s', job_id, kind, attempts, error)
+        if fail(job_id, worker_id, attempts, error) and kind in DEAD_HANDLERS:
+            DEAD_HANDLERS[kind](payload)
+    else:
+        if not complete(job_id, worker_id):
+            logger.warning('Job %s (%s) finished after its lease was taken over; result left to the new owner',
+                           job_id, kind)
+    finally:
+        stop.set()
+        metrics.reset_route(token)
+
+
+def run_worker(worker_id=None, kinds=None, poll_interval=1.0, once=False, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Claim and run jobs until interrupted (or until the queue is empty when `once` is set)."""
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    logger.info('Worker %s started', worker_id)
+    while True:
+        job = claim(worker_id, kinds, lease_seconds)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        run_job(*job, worker_id=worker_id, lease_seconds=lease_seconds)
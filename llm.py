@@ -1,12 +1,24 @@
 # llm.py
 import json
-import google.generativeai as genai
-import os
 from questions import DEFAULT_QUESTIONS
 import re
+import llm_cache
+from chat_ingest import summarize as summarize_chat  # One streaming pass over the uploaded chat export
+import metrics
+from llm_client import Completion, estimate_tokens, get_provider  # Shared per-process clients (reads GOOGLE_API_KEY / LLM_BACKEND)
 
-# Configure with your API key (use os.getenv('GOOGLE_API_KEY') in production)
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+MODEL_NAME = 'gemini-1.5-flash'
+
+def _generate(call_type, prompt, generation_config=None, validate=None):
+    # Identical prompts (re-submitted clones, reloaded matches) are served from llm_cache
+    provider = get_provider('gemini')
+    key = llm_cache.make_key(provider.name, MODEL_NAME, prompt=prompt, generation_config=generation_config)
+    with metrics.llm_call(call_type, provider.name, MODEL_NAME) as call:
+        def compute():
+            result = provider.complete(call_type, MODEL_NAME, prompt=prompt, generation_config=generation_config)
+            call.set_usage(result)
+            return result.text
+        return llm_cache.cached_call(call_type, key, compute, validate=validate)
 
 def generate_persona(answers, text_path=None):
     # Build prompt from answers
@@ -16,24 +28,30 @@ def generate_persona(answers, text_path=None):
             q_text = next((q['text'] for q in DEFAULT_QUESTIONS if q['id'] == q_id), q_id)
             prompt_lines.append(f"- {q_text}: {answer}")
     
-    # Sample text file messages for style analysis
+    # Summarize the text file (style statistics plus a representative sample) for style analysis
     text_samples = ""
     if text_path:
         try:
-            with open(text_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()[:20]  # Limit to 20 lines for token efficiency
-                text_samples = "\nTexting style samples:\n" + "".join(lines)
+            text_samples = "\n" + summarize_chat(text_path)
         except Exception as e:
             text_samples = f"Error reading text file: {str(e)}"
     
     prompt = "\n".join(prompt_lines) + text_samples + "\nSummarize into a detailed persona description, capturing interests, tone, texting style (e.g., emojis, slang, sentence length), and personality for realistic bot conversations.'"
     
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    response = model.generate_content(prompt)
-    return response.text
+    return _generate('persona', prompt)
 
-def generate_conversation(user_answers, user_persona, other_answers, other_persona, user_name, other_name):
-    prompt = (
+def patch_persona(persona, changed):
+    """Revise an existing persona for a few changed answers ({q_id: (old, new)}) instead of rebuilding it."""
+    prompt_lines = ["Here is a persona summary for a dating bot:", persona, "", "The person has since changed these profile answers:"]
+    for q_id, (old, new) in changed.items():
+        q_text = next((q['text'] for q in DEFAULT_QUESTIONS if q['id'] == q_id), q_id)
+        prompt_lines.append(f"- {q_text}: was \"{old or 'unanswered'}\", now \"{new or 'unanswered'}\"")
+    prompt = "\n".join(prompt_lines) + "\nRewrite the persona so it reflects the new answers. Keep everything the changes don't affect, especially the texting style description, as it is. Respond with the full updated persona only."
+    
+    return _generate('persona_patch', prompt)
+
+def _conversation_prompt(user_answers, user_persona, other_answers, other_persona, user_name, other_name):
+    return (
         f"Generate a realistic dating conversation between two bots.\n"
         f"User bot (named {user_name}) persona: {user_persona}\n"
         f"Other bot (named {other_name}) persona: {other_persona}\n"
@@ -41,19 +59,40 @@ def generate_conversation(user_answers, user_persona, other_answers, other_perso
         f"Other profile: {json.dumps(other_answers)}\n"
         "Simulate a realistic back-and-forth chat with exactly 20 lines of dialogue (10 messages from each bot, alternating), where each bot responds in their respective style, reflecting their interests and personality. Generally follow the following guidelines: 1) Start with something similar to the pickup lines they gave, 2) Don't have the bots assume any information about the other bot, have them learn about each other, 3) If they don't connect, make that apparent in the conversation. 4) Don't be repetitive. Format as:\n{user_name}: Message\n{other_name}: Message\n{user_name}: Message\n..."
     )
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    response = model.generate_content(prompt)
-    return response.text
+
+def generate_conversation(user_answers, user_persona, other_answers, other_persona, user_name, other_name):
+    prompt = _conversation_prompt(user_answers, user_persona, other_answers, other_persona, user_name, other_name)
+    return _generate('conversation', prompt)
+
+def stream_conversation(user_answers, user_persona, other_answers, other_persona, user_name, other_name):
+    """Same as generate_conversation, but yields text chunks as the model produces them."""
+    prompt = _conversation_prompt(user_answers, user_persona, other_answers, other_persona, user_name, other_name)
+    # Shares cache entries with generate_conversation: a hit is replayed as a single chunk
+    provider = get_provider('gemini')
+    key = llm_cache.make_key(provider.name, MODEL_NAME, prompt=prompt, generation_config=None)
+    with metrics.llm_call('conversation', provider.name, MODEL_NAME) as call:
+        cached = llm_cache.get('conversation', key)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        for chunk in provider.stream('conversation', MODEL_NAME, prompt=prompt):
+            call.mark_first_chunk()
+            chunks.append(chunk)
+            yield chunk
+        text = ''.join(chunks)
+        # Streams don't report usage; estimate it like the rate limiter does
+        call.set_usage(Completion(text, estimate_tokens(prompt), estimate_tokens(text)))
+        llm_cache.put('conversation', key, text)
 
 def calculate_compatibility(user_answers, other_answers, conversation=None):
     prompt = f"Compare user answers: {json.dumps(user_answers)} with other answers: {json.dumps(other_answers)}"
     if conversation:
         prompt += f"\nConversation between the users:\n{conversation}\nEvaluate romantic compatibility based on both answers and conversation dynamics on a scale of 1-100."
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    response = model.generate_content(prompt)
+    text = _generate('compatibility', prompt)
     
     # Extract numerical score (e.g., '15/100' or '15') from response
-    match = re.search(r'\b(\d+)(?:/100)?\b', response.text)
+    match = re.search(r'\b(\d+)(?:/100)?\b', text)
     if match:
         score = float(match.group(1))
     else:
@@ -61,6 +100,69 @@ def calculate_compatibility(user_answers, other_answers, conversation=None):
     
     return score
 
+# Schema for the combined evaluation: the whole conversation and the score in one response
+EVALUATION_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'turns': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'speaker': {'type': 'string'},
+                    'text': {'type': 'string'},
+                },
+                'required': ['speaker', 'text'],
+            },
+        },
+        'score': {'type': 'integer'},
+    },
+    'required': ['turns', 'score'],
+}
+
+def parse_evaluation(text):
+    """Validate a combined evaluation response; raises ValueError if it doesn't match the schema."""
+    data = json.loads(text)
+    turns = data.get('turns') if isinstance(data, dict) else None
+    if not isinstance(turns, list) or not turns:
+        raise ValueError('evaluation has no turns')
+    lines = []
+    for turn in turns:
+        if not isinstance(turn, dict) or not isinstance(turn.get('text'), str) or not turn['text'].strip():
+            raise ValueError(f'malformed turn: {turn!r}')
+        lines.append(turn['text'].strip())
+    score = data.get('score')
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 100:
+        raise ValueError(f'score out of range: {score!r}')
+    return '\n'.join(lines), float(score)
+
+def evaluate_match(user_answers, user_persona, other_answers, other_persona, user_name, other_name):
+    """
+    Generate the conversation and score it in a single structured call.
+    Returns (conversation, score) with one message per line; raises ValueError if the
+    response doesn't parse so callers can fall back to the two-call path.
+    """
+    prompt = (
+        f"Generate a realistic dating conversation between two bots, then rate their romantic compatibility.\n"
+        f"User bot (named {user_name}) persona: {user_persona}\n"
+        f"Other bot (named {other_name}) persona: {other_persona}\n"
+        f"User profile: {json.dumps(user_answers)}\n"
+        f"Other profile: {json.dumps(other_answers)}\n"
+        "Simulate a realistic back-and-forth chat with exactly 20 lines of dialogue (10 messages from each bot, alternating, "
+        f"starting with {user_name}), where each bot responds in their respective style, reflecting their interests and personality. "
+        "Generally follow the following guidelines: 1) Start with something similar to the pickup lines they gave, 2) Don't have the bots "
+        "assume any information about the other bot, have them learn about each other, 3) If they don't connect, make that apparent in the "
+        "conversation. 4) Don't be repetitive.\n"
+        "Then evaluate romantic compatibility based on both profiles and the conversation dynamics on a scale of 1-100.\n"
+        f"Respond with JSON: {{\"turns\": [{{\"speaker\": \"{user_name}\", \"text\": \"...\"}}, ...], \"score\": <1-100>}}. "
+        "Message text must not include the speaker's name."
+    )
+    text = _generate('evaluation', prompt, generation_config={
+        'response_mime_type': 'application/json',
+        'response_schema': EVALUATION_SCHEMA,
+    }, validate=parse_evaluation)
+    return parse_evaluation(text)
+
 '''def calculate_compatibility(user_answers, other_answers):
     prompt = f"Calculate a realistic compatibility score (0-100) between: {json.dumps(user_answers)} and {json.dumps(other_answers)}. Respond with just the number and make it truly any number in the range 0 to 100."
     print("User Answers: \n", json.dumps(user_answers))
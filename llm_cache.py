@@ -0,0 +1,172 @@
+# llm_cache.py
+# Content-addressed LLM response cache in SQLite, shared by the web app and worker.py processes.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import metrics
+
+CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'llm_cache.db')
+CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600))  # Seconds before an entry is stale
+CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 50 * 1024 * 1024))  # LRU-evict beyond this
+# Comma-separated call types that should always go to the model, e.g. "conversation,clone_turn"
+DISABLED_CALL_TYPES = {t.strip() for t in os.getenv('LLM_CACHE_DISABLE', '').split(',') if t.strip()}
+
+# Per-process hit/miss counters by call type
+hits = Counter()
+misses = Counter()
+
+_local = threading.local()
+
+
+def _connect():
+    """This thread's cache connection (recreated after a fork, since connections can't be shared)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.key != (os.getpid(), CACHE_PATH):
+        conn = _local.conn = sqlite3.connect(CACHE_PATH, timeout=30)
+        _local.key = (os.getpid(), CACHE_PATH)
+        _init(conn)
+    return conn
+
+
+def _init(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                call_type TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)')
+        # Running total of `size`, kept by triggers so puts don't sum the whole table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache_size (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('INSERT OR IGNORE INTO llm_cache_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM llm_cache')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS llm_cache_size_insert AFTER INSERT ON llm_cache
+            BEGIN UPDATE llm_cache_size SET total = total + new.size; END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS llm_cache_size_update AFTER UPDATE OF size ON llm_cache
+            BEGIN UPDATE llm_cache_size SET total = total + new.size - old.size; END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS llm_cache_size_delete AFTER DELETE ON llm_cache
+            BEGIN UPDATE llm_cache_size SET total = total - old.size; END
+        ''')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def make_key(provider, model, prompt=None, messages=None, temperature=None, max_tokens=None, **extra):
+    """Hash of everything that determines the response; `extra` covers e.g. a response schema."""
+    payload = json.dumps({
+        'provider': provider,
+        'model': model,
+        'prompt': prompt,
+        'messages': messages,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'extra': extra,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def enabled(call_type):
+    # With a cassette (record or replay) every call must reach it: recording tapes each call, and a
+    # replay reproduces the recorded timing and must find every call it makes on the tape (see cassette.py)
+    return (CACHE_MAX_BYTES > 0 and call_type not in DISABLED_CALL_TYPES
+            and not os.getenv('LLM_CASSETTE_MODE'))
+
+
+def get(call_type, key):
+    """Return the cached response text for `key`, or None (expired entries count as misses)."""
+    if not enabled(call_type):
+        return None
+    now = time.time()
+    conn = _connect()
+    row = conn.execute('SELECT response, created_at FROM llm_cache WHERE key = ?', (key,)).fetchone()
+    if row is None or now - row[1] > CACHE_TTL:
+        misses[call_type] += 1
+        metrics.note_cache('miss')
+        return None
+    conn.execute('UPDATE llm_cache SET accessed_at = ? WHERE key = ?', (now, key))
+    conn.commit()
+    hits[call_type] += 1
+    metrics.note_cache('hit')
+    return row[0]
+
+
+def put(call_type, key, response):
+    if not enabled(call_type) or response is None:
+        return
+    now = time.time()
+    size = len(response.encode('utf-8'))
+    conn = _connect()
+    try:
+        # An upsert rather than INSERT OR REPLACE: REPLACE's implicit delete doesn't fire the size trigger
+        conn.execute('''
+            INSERT INTO llm_cache (key, call_type, response, size, created_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                call_type = excluded.call_type, response = excluded.response, size = excluded.size,
+                created_at = excluded.created_at, accessed_at = excluded.accessed_at
+        ''', (key, call_type, response, size, now, now))
+        if conn.execute('SELECT total FROM llm_cache_size').fetchone()[0] > CACHE_MAX_BYTES:
+            _evict(conn, now)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _evict(conn, now):
+    # Expired entries first, then least recently used until we're back under the size budget
+    conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - CACHE_TTL,))
+    total = conn.execute('SELECT total FROM llm_cache_size').fetchone()[0]
+    if total <= CACHE_MAX_BYTES:
+        return
+    freed = 0
+    victims = []
+    for key, size in conn.execute('SELECT key, size FROM llm_cache ORDER BY accessed_at'):
+        victims.append((key,))
+        freed += size
+        if total - freed <= CACHE_MAX_BYTES:
+            break
+    conn.executemany('DELETE FROM llm_cache WHERE key = ?', victims)
+
+
+def cached_call(call_type, key, compute, validate=None):
+    """
+    Return the cached response for `key`, or run `compute()` and cache its result.
+    If `validate(response)` raises, the fresh response is not cached and the error propagates.
+    """
+    cached = get(call_type, key)
+    if cached is not None:
+        return cached
+    response = compute()
+    if validate is not None:
+        validate(response)
+    put(call_type, key, response)
+    return response
+
+
+def stats():
+    """Hit/miss counters for this process, by call type."""
+    return {t: {'hits': hits[t], 'misses': misses[t]} for t in sorted(set(hits) | set(misses))}
@@ -0,0 +1,149 @@
+# llm_client.py
+# Shared, lazily created LLM provider clients, configured once per process and reused across calls.
+
+import json
+import os
+import threading
+from collections import namedtuple
+
+import google.generativeai as genai
+
+import rate_limiter
+
+_lock = threading.Lock()
+_pid = None  # Clients hold live connections, which must not be shared across a fork (worker.py)
+_gemini_configured = False
+_gemini_models = {}
+_groq_client = None
+
+
+def _reset_after_fork():
+    global _pid, _gemini_configured, _gemini_models, _groq_client
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _gemini_configured = False
+        _gemini_models = {}
+        _groq_client = None
+
+
+def get_gemini_model(model_name):
+    """Return this process's GenerativeModel for `model_name`, configuring the SDK on first use."""
+    global _gemini_configured
+    with _lock:
+        _reset_after_fork()
+        if not _gemini_configured:
+            # The SDK keeps one client (and its gRPC channel) per process once configured
+            genai.configure(api_key=os.getenv('GOOGLE_API_KEY'), transport=os.getenv('GEMINI_TRANSPORT') or None)
+            _gemini_configured = True
+        model = _gemini_models.get(model_name)
+        if model is None:
+            model = _gemini_models[model_name] = genai.GenerativeModel(model_name)
+        return model
+
+
+def get_groq_client():
+    """Return this process's Groq client; its HTTP connection pool keeps connections alive between calls."""
+    global _groq_client
+    with _lock:
+        _reset_after_fork()
+        if _groq_client is None:
+            from groq import Groq  # Only needed by gpt_wrapper
+            import httpx
+
+            api_key = os.environ.get("GROQ_API_KEY")
+            if not api_key:
+                raise RuntimeError("Missing GROQ_API_KEY env var. `export GROQ_API_KEY=...`")
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+                timeout=httpx.Timeout(60.0, connect=10.0),
+            )
+            # Retries and backoff are handled by rate_limiter, not the SDK
+            _groq_client = Groq(api_key=api_key, http_client=http_client, max_retries=0)
+        return _groq_client
+
+
+# =========================
+# Providers
+# =========================
+# Every LLM call goes through a provider's complete()/stream(). Set LLM_BACKEND=fake to swap
+# all of them for the offline fake in fake_llm.py (load tests, local development), and
+# LLM_CASSETTE_MODE=record|replay to tape or play back calls (see cassette.py).
+
+# complete() result; token counts are None when the provider doesn't report them
+Completion = namedtuple('Completion', ['text', 'prompt_tokens', 'completion_tokens'])
+
+
+def estimate_tokens(text):
+    return len(text or '') // 4  # ~4 characters per token
+
+
+class GeminiProvider:
+    name = 'gemini'
+
+    def complete(self, call_type, model, prompt=None, messages=None, temperature=None, max_tokens=None,
+                 generation_config=None):
+        client = get_gemini_model(model)
+        response = rate_limiter.call_with_retries(
+            self.name, lambda: client.generate_content(prompt, generation_config=generation_config),
+            est_tokens=rate_limiter.estimate_tokens(prompt, max_tokens))
+        usage = getattr(response, 'usage_metadata', None)
+        return Completion(response.text, getattr(usage, 'prompt_token_count', None),
+                          getattr(usage, 'candidates_token_count', None))
+
+    def stream(self, call_type, model, prompt=None, messages=None, temperature=None, max_tokens=None):
+        client = get_gemini_model(model)
+        # The concurrency slot is held until the stream is consumed; errors mid-stream aren't retried
+        chunks = rate_limiter.stream_with_retries(
+            self.name, lambda: client.generate_content(prompt, stream=True),
+            est_tokens=rate_limiter.estimate_tokens(prompt, max_tokens))
+        for chunk in chunks:
+            if chunk.text:
+                yield chunk.text
+
+
+class GroqProvider:
+    name = 'groq'
+
+    def complete(self, call_type, model, prompt=None, messages=None, temperature=None, max_tokens=None,
+                 generation_config=None):
+        messages = messages or [{'role': 'user', 'content': prompt}]
+        resp = rate_limiter.call_with_retries(self.name, lambda: get_groq_client().chat.completions.create(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            messages=messages
+        ), est_tokens=rate_limiter.estimate_tokens(json.dumps(messages), max_tokens))
+        usage = getattr(resp, 'usage', None)
+        return Completion(resp.choices[0].message.content.strip(), getattr(usage, 'prompt_tokens', None),
+                          getattr(usage, 'completion_tokens', None))
+
+    def stream(self, call_type, model, prompt=None, messages=None, temperature=None, max_tokens=None):
+        # One non-streaming call, so the slot is held (inside complete()) until the whole response is in
+        yield self.complete(call_type, model, prompt, messages, temperature, max_tokens).text
+
+
+PROVIDERS = {'gemini': GeminiProvider, 'groq': GroqProvider}
+_providers = {}
+
+
+def get_provider(name):
+    """
+    Provider instance for `name` ('gemini' or 'groq'), or the fake backend when LLM_BACKEND=fake,
+    wrapped in a cassette recorder/player when LLM_CASSETTE_MODE is set.
+    """
+    backend = os.getenv('LLM_BACKEND', 'real')
+    key = 'fake' if backend == 'fake' else name
+    with _lock:
+        provider = _providers.get(key)
+        if provider is None:
+            if key == 'fake':
+                from fake_llm import FakeProvider
+                provider = FakeProvider()
+            else:
+                provider = PROVIDERS[name]()
+            mode = os.getenv('LLM_CASSETTE_MODE')
+            if mode:
+                from cassette import CassetteProvider
+                provider = CassetteProvider(provider, mode)
+            _providers[key] = provider
+        return provider
@@ -0,0 +1,280 @@
+# matching.py
+# Concurrent evaluation engine for scoring candidate clones against the viewer's clone,
+# backed by a persistent pairwise match cache (the `matches` table). Every scored pair is also
+# merged into the precomputed per-clone lists date_clones reads (see top_matches.py).
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import contextvars
+import logging
+import threading
+
+from db import get_db
+from llm import generate_conversation, calculate_compatibility, evaluate_match, stream_conversation
+from top_matches import merge as merge_top_match
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8  # Upper bound on concurrent candidate pipelines per process
+DEFAULT_DEADLINE = 12.0  # Seconds each candidate gets before it is reported as still scoring
+
+# One pool per process so parallel page views share the same bound on LLM fan-out
+_executor = None
+_executor_lock = threading.Lock()
+
+# Pipelines still running, keyed by match key, so a reload joins them instead of starting over
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def get_executor(max_workers=DEFAULT_MAX_WORKERS):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='match')
+        return _executor
+
+
+def clean_conversation(conversation, user_name, other_name):
+    # Remove name prefixes (You:, other_name:, user_name:) from each line
+    cleaned_lines = []
+    for line in conversation.split('\n'):
+        line = line.strip()
+        if line.startswith('You:'):
+            cleaned_lines.append(line[4:].strip())
+        elif line.startswith(f'{other_name}:'):
+            cleaned_lines.append(line[len(other_name)+1:].strip())
+        elif line.startswith(f'{user_name}:'):
+            cleaned_lines.append(line[len(user_name)+1:].strip())
+        elif line:
+            cleaned_lines.append(line)
+    return '\n'.join(cleaned_lines)
+
+
+# =========================
+# Pairwise match cache
+# =========================
+def match_key(user, other):
+    """(viewer id, viewer version, other id, other version): edits bump a clone's version, so they miss the cache."""
+    return user['id'], user['version'], other['id'], other['version']
+
+
+def load_match(user, other):
+    """
+    Return the cached {'conversation', 'score', 'reversed'} for this pair, or None. A pair has one
+    conversation whichever clone it was evaluated for; `reversed` means `other` speaks first in it.
+    """
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT conversation, score, viewer_clone_id != ? FROM matches
+        WHERE (viewer_clone_id = ? AND viewer_version = ? AND other_clone_id = ? AND other_version = ?)
+           OR (viewer_clone_id = ? AND viewer_version = ? AND other_clone_id = ? AND other_version = ?)
+    ''', (user['id'], *match_key(user, other), *match_key(other, user)))
+    row = cursor.fetchone()
+    return {'conversation': row[0], 'score': row[1], 'reversed': bool(row[2])} if row else None
+
+
+def save_match(user, other, conversation, score):
+    """
+    Cache a pair's conversation and merge its score into both clones' top-match lists, in one
+    transaction. The first evaluation of a pair at given versions wins: one that finds the pair already
+    evaluated (in either direction) is dropped, so a list's score is always the shown conversation's.
+    One made for a version of either clone that has since been replaced is dropped too.
+    Returns True if it was saved.
+    """
+    conn = get_db()
+    cursor = conn.execute('''
+        INSERT INTO matches (viewer_clone_id, viewer_version, other_clone_id, other_version, conversation, score)
+        SELECT ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM matches
+            WHERE viewer_clone_id = ? AND viewer_version = ? AND other_clone_id = ? AND other_version = ?
+        )
+          AND EXISTS (SELECT 1 FROM clones WHERE id = ? AND version = ?)
+          AND EXISTS (SELECT 1 FROM clones WHERE id = ? AND version = ?)
+        ON CONFLICT (viewer_clone_id, other_clone_id) DO UPDATE SET
+            viewer_version = excluded.viewer_version, other_version = excluded.other_version,
+            conversation = excluded.conversation, score = excluded.score, updated_at = CURRENT_TIMESTAMP
+        WHERE excluded.viewer_version >= viewer_version AND excluded.other_version >= other_version
+          AND (excluded.viewer_version > viewer_version OR excluded.other_version > other_version)
+    ''', (*match_key(user, other), conversation, score, *match_key(other, user), *match_key(user, other)))
+    saved = cursor.rowcount > 0
+    if saved and score is not None:
+        merge_top_match(conn.cursor(), user, other, score)
+    conn.commit()
+    return saved
+
+
+def invalidate_matches(cursor, clone_id, version):
+    """Drop cached matches made with an older version of `clone_id` (call in the transaction that bumps it)."""
+    cursor.execute('''
+        DELETE FROM matches
+        WHERE (viewer_clone_id = ? AND viewer_version < ?) OR (other_clone_id = ? AND other_version < ?)
+    ''', (clone_id, version, clone_id, version))
+
+
+# =========================
+# Evaluation
+# =========================
+def evaluate_candidate(user, other):
+    """Run the full conversation + compatibility pipeline for one candidate and cache the result."""
+    try:
+        # One structured call returns both the conversation and the score
+        conversation, score = evaluate_match(user['answers'], user['persona'], other['answers'], other['persona'],
+                                             user['name'], other['name'])
+        conversation = clean_conversation(conversation, user['name'], other['name'])
+    except ValueError as e:
+        # Response didn't match the schema; fall back to separate conversation and scoring calls
+        logger.warning('Structured evaluation unparseable for clone %s, using two-call path: %s', other['id'], e)
+        conversation = generate_conversation(user['answers'], user['persona'], other['answers'], other['persona'],
+                                             user['name'], other['name'])
+        conversation = clean_conversation(conversation, user['name'], other['name'])
+        score = calculate_compatibility(user['answers'], other['answers'], conversation)
+    if not save_match(user, other, conversation, score):
+        # Evaluated concurrently from the other side (or an earlier run); report the stored one. None if
+        # either clone was edited meanwhile (its new version gets its own evaluation)
+        return load_match(user, other)
+    return {'conversation': conversation, 'score': score, 'reversed': False}
+
+
+def stream_match(user, other):
+    """
+    Yield (mine, text) for each of the pair's cleaned messages, `mine` being True for the user's
+    clone. Cached (or already in-flight) pairs are replayed; otherwise the conversation is streamed
+    from the model, and once it completes it is scored in the background and written to the cache.
+    The stream is registered as in flight, so concurrent viewers of the pair wait and replay it.
+    """
+    cached, future = _join_or_claim(user, other)
+    if cached is not None:
+        first = 1 if cached['reversed'] else 0
+        for i, line in enumerate(cached['conversation'].split('\n')):
+            yield (i + first) % 2 == 0, line
+        return
+
+    lines = []
+    buffer = ''
+    streamed = False
+    try:
+        chunks = stream_conversation(user['answers'], user['persona'], other['answers'], other['persona'],
+                                     user['name'], other['name'])
+        for chunk in chunks:
+            buffer += chunk
+            # Emit every complete line as soon as its newline arrives
+            *complete, buffer = buffer.split('\n')
+            for raw in complete:
+                line = clean_conversation(raw, user['name'], other['name'])
+                if line:
+                    lines.append(line)
+                    yield len(lines) % 2 == 1, line
+        line = clean_conversation(buffer, user['name'], other['name'])
+        if line:
+            lines.append(line)
+            yield len(lines) % 2 == 1, line
+        streamed = True
+    finally:
+        if not streamed:
+            # Model error or the viewer left: release anyone waiting on this pair so they retry
+            future.set_exception(RuntimeError(f'Streaming the conversation with clone {other["id"]} did not finish'))
+
+    conversation = '\n'.join(lines)
+    get_executor().submit(contextvars.copy_context().run, _score_and_save, user, other, conversation, future)
+
+
+def _join_or_claim(user, other):
+    """
+    Return (cached, None) once the pair is cached or an in-flight evaluation of it finishes, or
+    (None, future) with a new future registered in flight that the caller must resolve.
+    """
+    key = match_key(user, other)
+    while True:
+        cached = load_match(user, other)
+        if cached is not None:
+            return cached, None
+        with _in_flight_lock:
+            future = _in_flight.get(key)
+            reverse = _in_flight.get(match_key(other, user))
+            if future is None and reverse is None:
+                future = Future()
+                _in_flight[key] = future
+                future.add_done_callback(lambda f: _forget(key))
+                return None, future
+        try:
+            if future is not None:
+                cached = future.result()
+                if cached is not None:
+                    return cached, None
+            else:
+                reverse.result()  # Evaluated for the other clone: the next load_match reads it with its direction
+        except Exception:
+            pass  # That evaluation failed or was abandoned; look again, and generate it here if nobody else is
+
+
+def _score_and_save(user, other, conversation, future):
+    # If the pair got evaluated meanwhile (e.g. by a refresh job), save_match keeps that result
+    try:
+        score = calculate_compatibility(user['answers'], other['answers'], conversation)
+        if save_match(user, other, conversation, score):
+            future.set_result({'conversation': conversation, 'score': score, 'reversed': False})
+        else:
+            future.set_result(load_match(user, other))
+    except Exception as e:
+        logger.exception('Scoring streamed conversation failed for clone %s', other['id'])
+        future.set_exception(e)
+
+
+def _submit(user, other):
+    key = match_key(user, other)
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is None:
+            # Carry the request's context (metrics route) into the pool thread
+            future = get_executor().submit(contextvars.copy_context().run, evaluate_candidate, user, other)
+            _in_flight[key] = future
+            future.add_done_callback(lambda f: _forget(key))
+        return future
+
+
+def _forget(key):
+    with _in_flight_lock:
+        _in_flight.pop(key, None)
+
+
+def evaluate_candidates(user, candidates, deadline=DEFAULT_DEADLINE, max_workers=DEFAULT_MAX_WORKERS, enqueue=None):
+    """
+    Serve cached pairs directly, then fan out one pipeline per remaining candidate on the
+    shared pool and wait at most `deadline` seconds. Returns one entry per candidate (in
+    input order) with a `status` of 'done', 'pending' (missed the deadline, keeps running
+    in the background and lands in the cache) or 'error'.
+
+    If `enqueue(user, candidate)` is given, cache misses are handed to it (e.g. the job
+    queue) and reported as pending right away instead of being evaluated in-process.
+    """
+    futures = []
+    for candidate in candidates:
+        cached = load_match(user, candidate)
+        future = None
+        if not cached:
+            if enqueue:
+                enqueue(user, candidate)
+            else:
+                get_executor(max_workers)
+                future = _submit(user, candidate)
+        futures.append((future, candidate, cached))
+    wait([f for f, _, _ in futures if f is not None], timeout=deadline)
+
+    results = []
+    for future, candidate, cached in futures:
+        entry = {'candidate': candidate, 'status': 'pending', 'score': None, 'conversation': None}
+        if cached:
+            entry.update(cached)
+            entry['status'] = 'done'
+        elif future is not None and future.done():
+            try:
+                result = future.result()
+                if result is not None:
+                    entry.update(result)
+                    entry['status'] = 'done'
+            except Exception as e:
+                logger.error('Evaluation failed for clone %s: %s', candidate['id'], e)
+                entry['status'] = 'error'
+        results.append(entry)
+    return results
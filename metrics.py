@@ -0,0 +1,216 @@
+# metrics.py
+# In-process LLM call instrumentation, exposed in Prometheus text format on /metrics.
+#
+# Every LLM call runs inside `with llm_call(call_type, provider, model) as call:`, which records
+# latency, prompt/completion tokens, retries (counted by rate_limiter), cache status (set by
+# llm_cache) and the route that triggered it. Percentiles come from the histograms, e.g.
+#   histogram_quantile(0.95, sum by (le, call_type) (rate(llm_call_latency_seconds_bucket[5m])))
+# and spend per route from llm_cost_usd_total.
+#
+# Metrics are per process: each gunicorn worker serves its own, and worker.py jobs are counted in
+# the worker processes (under route "job:<kind>"), which don't expose an endpoint.
+
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+import tracing
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384)
+
+# USD per million (prompt, completion) tokens; unknown models are counted at zero cost
+PRICES = {
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.5-pro': (1.25, 5.00),
+    'llama-3.3-70b-versatile': (0.59, 0.79),
+    'llama-3.1-8b-instant': (0.05, 0.08),
+}
+
+# Flask endpoint (or "job:<kind>") that triggered the current LLM calls
+_route = contextvars.ContextVar('metrics_route', default='-')
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def set_route(route):
+    """Attribute LLM calls in the current context to `route`; returns a token for reset_route()."""
+    return _route.set(route)
+
+
+def reset_route(token):
+    _route.reset(token)
+
+
+# =========================
+# Registry
+# =========================
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name, self.help, self.labels = name, help_text, labels
+        self.values = defaultdict(float)
+
+    def inc(self, label_values, amount=1.0):
+        self.values[label_values] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_labels(self.labels, label_values)} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets):
+        self.name, self.help, self.labels, self.buckets = name, help_text, labels, buckets
+        self.values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, label_values, value):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.labels + ("le",), label_values + (le,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {_number(series[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {cumulative}')
+        return lines
+
+
+def _labels(names, values):
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+CALLS = Counter('llm_calls_total', 'LLM calls by outcome and cache status.',
+                ('route', 'call_type', 'provider', 'model', 'cache', 'status'))
+LATENCY = Histogram('llm_call_latency_seconds', 'Wall time of LLM calls, including cache lookups and retries.',
+                    ('route', 'call_type', 'model', 'cache'), LATENCY_BUCKETS)
+FIRST_CHUNK = Histogram('llm_stream_first_chunk_seconds', 'Time to the first chunk of streamed LLM calls.',
+                        ('route', 'call_type', 'model'), LATENCY_BUCKETS)
+PROMPT_TOKENS = Histogram('llm_prompt_tokens', 'Prompt tokens per uncached LLM call.',
+                          ('call_type', 'model'), TOKEN_BUCKETS)
+COMPLETION_TOKENS = Histogram('llm_completion_tokens', 'Completion tokens per uncached LLM call.',
+                              ('call_type', 'model'), TOKEN_BUCKETS)
+TOKENS = Counter('llm_tokens_total', 'Tokens sent to and received from LLM providers.',
+                 ('route', 'call_type', 'model', 'kind'))
+RETRIES = Counter('llm_retries_total', 'Retried LLM requests (429, 5xx, transient network errors).',
+                  ('route', 'call_type', 'provider', 'model'))
+COST = Counter('llm_cost_usd_total', 'Estimated LLM spend in USD, from PRICES.',
+               ('route', 'call_type', 'model'))
+REGISTRY = [CALLS, LATENCY, FIRST_CHUNK, PROMPT_TOKENS, COMPLETION_TOKENS, TOKENS, RETRIES, COST]
+
+
+def render():
+    """All metrics in Prometheus text exposition format."""
+    with _lock:
+        lines = []
+        for metric in REGISTRY:
+            lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def cost_of(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+    return ((prompt_tokens or 0) * prompt_price + (completion_tokens or 0) * completion_price) / 1e6
+
+
+# =========================
+# Call tracking
+# =========================
+class llm_call:
+    """Context manager measuring one LLM call; the innermost active call is current_call() in this thread."""
+
+    def __init__(self, call_type, provider, model):
+        self.call_type = call_type
+        self.provider = provider
+        self.model = model
+        self.route = _route.get()
+        self.cache = 'off'  # 'hit' / 'miss' once llm_cache has been consulted
+        self.retries = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.first_chunk = None
+
+    def __enter__(self):
+        self._parent = getattr(_local, 'call', None)
+        _local.call = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        latency = time.perf_counter() - self._start
+        _local.call = self._parent
+        if exc_type is None:
+            status = 'ok'
+        elif issubclass(exc_type, GeneratorExit):
+            status = 'cancelled'  # Stream closed by the client before it finished
+        else:
+            status = 'error'
+        self._observe(status, latency)
+        tracing.record('llm', self._start, f'{self.call_type} cache={self.cache} {status}')
+        return False
+
+    def set_usage(self, completion):
+        """Record token counts from a provider Completion."""
+        self.prompt_tokens = completion.prompt_tokens
+        self.completion_tokens = completion.completion_tokens
+
+    def mark_first_chunk(self):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter() - self._start
+
+    def _observe(self, status, latency):
+        with _lock:
+            CALLS.inc((self.route, self.call_type, self.provider, self.model, self.cache, status))
+            LATENCY.observe((self.route, self.call_type, self.model, self.cache), latency)
+            if self.first_chunk is not None:
+                FIRST_CHUNK.observe((self.route, self.call_type, self.model), self.first_chunk)
+            if self.retries:
+                RETRIES.inc((self.route, self.call_type, self.provider, self.model), self.retries)
+            if self.prompt_tokens is not None:
+                PROMPT_TOKENS.observe((self.call_type, self.model), self.prompt_tokens)
+                TOKENS.inc((self.route, self.call_type, self.model, 'prompt'), self.prompt_tokens)
+            if self.completion_tokens is not None:
+                COMPLETION_TOKENS.observe((self.call_type, self.model), self.completion_tokens)
+                TOKENS.inc((self.route, self.call_type, self.model, 'completion'), self.completion_tokens)
+            cost = cost_of(self.model, self.prompt_tokens, self.completion_tokens)
+            if cost:
+                COST.inc((self.route, self.call_type, self.model), cost)
+
+
+def current_call():
+    return getattr(_local, 'call', None)
+
+
+def note_retry():
+    call = current_call()
+    if call is not None:
+        call.retries += 1
+
+
+def note_cache(status):
+    call = current_call()
+    if call is not None:
+        call.cache = status
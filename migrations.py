@@ -0,0 +1,358 @@
+# migrations.py
+# Versioned schema migrations for users.db, tracked in PRAGMA user_version.
+#
+# Each migration runs in its own BEGIN IMMEDIATE transaction together with the user_version bump,
+# so a failed migration leaves the database at the previous version and the next start retries it.
+# Migrations are also idempotent (IF NOT EXISTS, column checks), because databases created before
+# this runner existed start at version 0 with part of the schema already in place.
+#
+# Keep them online-friendly: ADD COLUMN and CREATE INDEX don't rebuild the table, so prefer those
+# to copying a table into a new one.
+#
+#   python migrations.py            # apply pending migrations
+#   python migrations.py --status   # show the current and latest version
+
+import argparse
+import json
+import logging
+
+from db import connect
+from jobs import init_jobs_table
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH = 1000  # Rows a backfill loads at a time
+
+# Frozen copy of the Likert questions (prefilter.LIKERT_QUESTIONS) as the backfills below encoded them,
+# so later edits to questions.py or prefilter.py can't change what an already-written migration does
+_LIKERT_IDS = [f'q{i}' for i in range(1, 17)]
+_LIKERT_OPTIONS = ['Completely disagree', 'Disagree', 'Neutral', 'Agree', 'Completely agree']
+
+
+def _columns(cursor, table):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [col[1] for col in cursor.fetchall()]
+
+
+def _encode_answers(answers):
+    # prefilter.encode_answers at migration 2: one byte per Likert question, 1-5 for the option, 0 if skipped
+    return bytes(_LIKERT_OPTIONS.index(answers[q]) + 1 if answers.get(q) in _LIKERT_OPTIONS else 0
+                 for q in _LIKERT_IDS)
+
+
+# =========================
+# Migrations
+# =========================
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            answers_json TEXT NOT NULL,
+            text_path TEXT,
+            persona TEXT,
+            profile_pic_path TEXT,
+            name TEXT NOT NULL,
+            answers_vec BLOB,
+            persona_status TEXT NOT NULL DEFAULT 'pending',
+            image_status TEXT,
+            fingerprint TEXT,
+            text_hash TEXT,
+            image_hash TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # Cached pairwise evaluations shared by date_clones and view_match
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS matches (
+            viewer_clone_id INTEGER NOT NULL,
+            other_clone_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            conversation TEXT NOT NULL,
+            score REAL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (viewer_clone_id, other_clone_id, content_hash)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_other ON matches (other_clone_id)')
+
+    # Durable background job queue (see jobs.py / worker.py)
+    init_jobs_table(cursor)
+
+
+def upgrade_clone_columns(cursor):
+    """Bring clones tables from before the columns were added up to date (formerly fix_db.py and init_db)."""
+    columns = _columns(cursor, 'clones')
+    if 'name' not in columns:
+        cursor.execute('ALTER TABLE clones ADD COLUMN name TEXT')
+    if 'llm_conversation' in columns:
+        cursor.execute('ALTER TABLE clones DROP COLUMN llm_conversation')
+
+    # Likert vector column, backfilled from answers_json
+    if 'answers_vec' not in columns:
+        cursor.execute('ALTER TABLE clones ADD COLUMN answers_vec BLOB')
+    last_id = 0
+    while True:
+        cursor.execute('SELECT id, answers_json FROM clones WHERE answers_vec IS NULL AND id > ? ORDER BY id LIMIT ?',
+                       (last_id, BACKFILL_BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany('UPDATE clones SET answers_vec = ? WHERE id = ?',
+                           [(_encode_answers(json.loads(answers_json)), clone_id) for clone_id, answers_json in rows])
+        last_id = rows[-1][0]
+
+    # Background generation status: persona_status is 'pending', 'ready' or 'failed';
+    # image_status is the same for the composited profile picture (NULL when none was uploaded)
+    if 'persona_status' not in columns:
+        cursor.execute("ALTER TABLE clones ADD COLUMN persona_status TEXT NOT NULL DEFAULT 'pending'")
+        cursor.execute("UPDATE clones SET persona_status = 'ready' WHERE persona IS NOT NULL")
+    if 'image_status' not in columns:
+        cursor.execute('ALTER TABLE clones ADD COLUMN image_status TEXT')
+        cursor.execute("UPDATE clones SET image_status = 'ready' WHERE profile_pic_path IS NOT NULL")
+
+    # Input fingerprints (see fingerprint.py); NULL for older clones, which regenerate on their next update
+    for column in ('fingerprint', 'text_hash', 'image_hash'):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE clones ADD COLUMN {column} TEXT')
+
+
+def normalize_image_paths(cursor):
+    # Formerly fix_image_paths.py: paths saved as "Uploads/..." don't resolve on case-sensitive file systems
+    cursor.execute("UPDATE clones SET profile_pic_path = replace(profile_pic_path, 'Uploads', 'uploads') "
+                   "WHERE profile_pic_path LIKE '%Uploads%'")
+
+
+def unique_clone_per_user(cursor):
+    """One clone per user: keep each user's newest clone, then let the index enforce it."""
+    # (No index on user_id yet, so no correlated subquery: one GROUP BY pass)
+    cursor.execute('SELECT id FROM clones WHERE id NOT IN (SELECT MAX(id) FROM clones GROUP BY user_id)')
+    stale = [row[0] for row in cursor.fetchall()]
+    for clone_id in stale:
+        cursor.execute('DELETE FROM matches WHERE viewer_clone_id = ? OR other_clone_id = ?', (clone_id, clone_id))
+        cursor.execute('DELETE FROM clones WHERE id = ?', (clone_id,))
+    if stale:
+        logger.info('Removed %d duplicate clones', len(stale))
+    # home, clone_status, create_clone, date_clones and view_match all look clones up by user_id
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_clones_user ON clones (user_id)')
+
+
+def candidate_index(cursor):
+    # date_clones' prefilter reads (id, answers_vec) of every ready clone; with this covering index it
+    # reads a narrow index range instead of every full row with its persona
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_clones_status_vec ON clones (persona_status, user_id, answers_vec)')
+
+
+def answers_table(cursor):
+    """
+    One row per (clone, question): Likert answers as 1-5 in `value`, free text in `text`.
+    clones.answers_json is still written alongside for older tooling, but reads go through models.Answer.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS answers (
+            clone_id INTEGER NOT NULL,
+            question_id TEXT NOT NULL,
+            value INTEGER,
+            text TEXT,
+            PRIMARY KEY (clone_id, question_id)
+        ) WITHOUT ROWID
+    ''')
+    # "Every clone who completely agrees with q1" is a range scan on this index
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_answers_question_value ON answers (question_id, value)')
+    # Answers go with their clone, whichever code path deletes it
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS clones_delete_answers AFTER DELETE ON clones
+        BEGIN
+            DELETE FROM answers WHERE clone_id = old.id;
+        END
+    ''')
+
+    # Backfill in one INSERT ... SELECT over json_each; the Likert questions share one 5-point scale
+    likert_ids = _LIKERT_IDS
+    options = _LIKERT_OPTIONS
+    ids = ','.join('?' * len(likert_ids))
+    value_case = ' '.join(f'WHEN ? THEN {i + 1}' for i in range(len(options)))
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO answers (clone_id, question_id, value, text)
+        SELECT c.id, j.key,
+               CASE WHEN j.key IN ({ids}) THEN CASE j.value {value_case} END END,
+               CASE WHEN j.key IN ({ids}) AND j.value IN ({','.join('?' * len(options))}) THEN NULL ELSE j.value END
+        FROM clones c, json_each(c.answers_json) j
+    ''', likert_ids + options + likert_ids + options)
+
+
+def sample_keys(cursor):
+    """Random per-clone sample_key: a fixed shuffled order that candidates.py samples windows of."""
+    if 'sample_key' not in _columns(cursor, 'clones'):
+        cursor.execute('ALTER TABLE clones ADD COLUMN sample_key INTEGER')  # ADD COLUMN can't default to random()
+    cursor.execute('UPDATE clones SET sample_key = random() WHERE sample_key IS NULL')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS clones_sample_key AFTER INSERT ON clones
+        WHEN new.sample_key IS NULL
+        BEGIN
+            UPDATE clones SET sample_key = random() WHERE id = new.id;
+        END
+    ''')
+    # Windows are range scans on this index; it also covers the vectors they score
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_clones_sample ON clones (persona_status, sample_key, user_id, answers_vec)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_clones_status_vec')  # Superseded: the full scan it served is gone
+
+
+def clone_versions(cursor):
+    """
+    Clones keep their id across edits: create_clone updates the row in place and bumps `version`,
+    so (id, version) names one exact state of a clone and caches key on that pair.
+    """
+    if 'version' not in _columns(cursor, 'clones'):
+        cursor.execute('ALTER TABLE clones ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+    # Append-only history: the state each edit replaced (drop the trigger to stop recording)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clone_history (
+            clone_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            answers_json TEXT NOT NULL,
+            name TEXT,
+            persona TEXT,
+            text_path TEXT,
+            profile_pic_path TEXT,
+            fingerprint TEXT,
+            replaced_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (clone_id, version)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS clones_history AFTER UPDATE OF version ON clones
+        WHEN new.version > old.version
+        BEGIN
+            INSERT OR IGNORE INTO clone_history (clone_id, version, answers_json, name, persona, text_path,
+                                                 profile_pic_path, fingerprint)
+            VALUES (old.id, old.version, old.answers_json, old.name, old.persona, old.text_path,
+                    old.profile_pic_path, old.fingerprint);
+        END
+    ''')
+
+    # Matches are keyed by both clones' versions instead of a hash of their content. The primary key
+    # changes, so this is the one table rebuild; it's a cache, and every surviving row belongs to the
+    # current state of its clones (edits used to delete them), i.e. to version 1.
+    cursor.execute('''
+        CREATE TABLE matches_new (
+            viewer_clone_id INTEGER NOT NULL,
+            other_clone_id INTEGER NOT NULL,
+            viewer_version INTEGER NOT NULL,
+            other_version INTEGER NOT NULL,
+            conversation TEXT NOT NULL,
+            score REAL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (viewer_clone_id, other_clone_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO matches_new (viewer_clone_id, other_clone_id, viewer_version, other_version,
+                                            conversation, score, created_at, updated_at)
+        SELECT viewer_clone_id, other_clone_id, 1, 1, conversation, score, created_at, updated_at
+        FROM matches ORDER BY updated_at
+    ''')
+    cursor.execute('DROP TABLE matches')
+    cursor.execute('ALTER TABLE matches_new RENAME TO matches')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_other ON matches (other_clone_id)')
+
+
+def top_matches_table(cursor):
+    """Per-clone lists of the best-scored other clones, maintained by background jobs (see top_matches.py)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS top_matches (
+            clone_id INTEGER NOT NULL,
+            other_clone_id INTEGER NOT NULL,
+            clone_version INTEGER NOT NULL,
+            other_version INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (clone_id, other_clone_id)
+        ) WITHOUT ROWID
+    ''')
+    # date_clones reads a list best-first; a refresh looks up the lists a clone appears in
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_top_matches_score ON top_matches (clone_id, score)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_top_matches_other ON top_matches (other_clone_id)')
+
+
+def top_matches_refreshed(cursor):
+    """The clone version whose top-match list was last refreshed, so an empty list isn't refreshed again."""
+    if 'top_matches_version' not in _columns(cursor, 'clones'):
+        cursor.execute('ALTER TABLE clones ADD COLUMN top_matches_version INTEGER')
+
+
+# (version, description, function), in order; append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, 'create tables', create_tables),
+    (2, 'upgrade legacy clone columns', upgrade_clone_columns),
+    (3, 'normalize profile picture paths', normalize_image_paths),
+    (4, 'unique clone per user', unique_clone_per_user),
+    (5, 'covering index for candidate prefilter', candidate_index),
+    (6, 'normalized answers table', answers_table),
+    (7, 'random sample keys for candidate windows', sample_keys),
+    (8, 'clone versions and history', clone_versions),
+    (9, 'precomputed top matches', top_matches_table),
+    (10, 'top match refresh marker', top_matches_refreshed),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# =========================
+# Runner
+# =========================
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations on an autocommit connection; returns the versions applied."""
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if current_version(conn) >= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have applied it while we waited for the write lock
+            if current_version(conn) >= version:
+                conn.execute('ROLLBACK')
+                continue
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logger.info('Applied migration %s: %s', version, description)
+        applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply users.db schema migrations.')
+    parser.add_argument('--status', action='store_true', help='only show the schema version')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    conn = connect(autocommit=True)
+    if args.status:
+        print(f'Schema version {current_version(conn)} (latest {LATEST_VERSION})')
+    else:
+        applied = migrate(conn)
+        print(f'Applied {len(applied)} migrations; schema version {current_version(conn)}.')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,174 @@
 # models.py
-import sqlite3
+# Thin model layer over users.db (schema in migrations.py). Methods take a cursor, so they join
+# whatever connection/transaction the caller is using (see db.py).
+from db import connect
+from migrations import migrate
+from questions import DEFAULT_QUESTIONS
 
 def init_db():
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clones (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            answers_json TEXT NOT NULL,
-            text_path TEXT,
-            persona TEXT,
-            profile_pic_path TEXT,
-            name TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-    ''')
-    conn.commit()
+    """Create or upgrade the schema (see migrations.py)."""
+    conn = connect(autocommit=True)  # Also switches the database file to WAL
+    migrate(conn)
     conn.close()
 
 class User:
-    pass
+    def __init__(self, id, username, password_hash=None):
+        self.id = id
+        self.username = username
+        self.password_hash = password_hash
 
-class Clone:
-    pass
+    @classmethod
+    def by_id(cls, cursor, user_id):
+        cursor.execute('SELECT id, username, password_hash FROM users WHERE id = ?', (user_id,))
+        row = cursor.fetchone()
+        return cls(*row) if row else None
+
+    @classmethod
+    def by_username(cls, cursor, username):
+        cursor.execute('SELECT id, username, password_hash FROM users WHERE username = ?', (username,))
+        row = cursor.fetchone()
+        return cls(*row) if row else None
 
 class Question:
-    pass
+    """A questionnaire item from questions.py. Likert answers are stored as 1-5 (the option's position)."""
+
+    def __init__(self, id, text, type, options=None, position=0):
+        self.id = id
+        self.text = text
+        self.type = type
+        self.options = options or []
+        self.position = position  # Order in the questionnaire (and in the answers dicts sent to the LLM)
+
+    @property
+    def is_likert(self):
+        return self.type == 'multiple-choice'
+
+    def encode(self, answer):
+        """(value, text) columns for an answer string."""
+        if answer is None:
+            return None, None
+        if self.is_likert and answer in self.options:
+            return self.options.index(answer) + 1, None
+        return None, answer
+
+    def decode(self, value, text):
+        if value is not None and 1 <= value <= len(self.options):
+            return self.options[value - 1]
+        return text
+
+    @classmethod
+    def get(cls, question_id):
+        return QUESTIONS.get(question_id) or cls(question_id, '', 'text', position=len(QUESTIONS))
+
+    @classmethod
+    def all(cls):
+        return list(QUESTIONS.values())
+
+QUESTIONS = {q['id']: Question(position=i, **q) for i, q in enumerate(DEFAULT_QUESTIONS)}
 
 class Answer:
-    pass
\ No newline at end of file
+    """One row of the answers table: a clone's answer to one question."""
+
+    def __init__(self, clone_id, question_id, value, text):
+        self.clone_id = clone_id
+        self.question_id = question_id
+        self.value = value
+        self.text = text
+
+    @property
+    def answer(self):
+        return Question.get(self.question_id).decode(self.value, self.text)
+
+    @staticmethod
+    def save_all(cursor, clone_id, answers):
+        """Replace a clone's answers with the {question id: answer} dict (skipped questions kept as NULL)."""
+        cursor.execute('DELETE FROM answers WHERE clone_id = ?', (clone_id,))
+        cursor.executemany('INSERT INTO answers (clone_id, question_id, value, text) VALUES (?, ?, ?, ?)',
+                           [(clone_id, q_id, *Question.get(q_id).encode(answer)) for q_id, answer in answers.items()])
+
+    @staticmethod
+    def for_clones(cursor, clone_ids):
+        """{clone id: {question id: answer}} in questionnaire order, for the given clones."""
+        by_clone = {clone_id: [] for clone_id in clone_ids}
+        if not by_clone:
+            return {}
+        clone_ids = list(by_clone)
+        cursor.execute(f'''
+            SELECT clone_id, question_id, value, text FROM answers
+            WHERE clone_id IN ({','.join('?' * len(clone_ids))})
+        ''', clone_ids)
+        for clone_id, q_id, value, text in cursor.fetchall():
+            question = Question.get(q_id)
+            by_clone[clone_id].append((question.position, q_id, question.decode(value, text)))
+        return {clone_id: {q_id: answer for _, q_id, answer in sorted(rows)} for clone_id, rows in by_clone.items()}
+
+    @staticmethod
+    def clone_ids_with(cursor, question_id, min_value=1, max_value=5, ready_only=True):
+        """
+        Clones whose Likert answer to `question_id` is within [min_value, max_value], e.g. everyone who
+        completely agrees with q1 ("I value honesty"): clone_ids_with(cursor, 'q1', min_value=5).
+        Served by idx_answers_question_value.
+        """
+        status_filter = "AND c.persona_status = 'ready'" if ready_only else ''
+        cursor.execute(f'''
+            SELECT a.clone_id FROM answers a JOIN clones c ON c.id = a.clone_id
+            WHERE a.question_id = ? AND a.value BETWEEN ? AND ? {status_filter}
+        ''', (question_id, min_value, max_value))
+        return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def distribution(cursor, question_id):
+        """{Likert option: number of clones that picked it} for one question."""
+        question = Question.get(question_id)
+        cursor.execute('''
+            SELECT value, COUNT(*) FROM answers WHERE question_id = ? AND value IS NOT NULL GROUP BY value
+        ''', (question_id,))
+        return {question.decode(value, None): count for value, count in cursor.fetchall()}
+
+class Clone:
+    COLUMNS = ('id', 'user_id', 'name', 'persona', 'persona_status', 'text_path', 'profile_pic_path', 'image_status',
+               'version')
+
+    def __init__(self, id, user_id, name, persona, persona_status, text_path, profile_pic_path, image_status,
+                 version=1):
+        self.id = id
+        self.user_id = user_id
+        self.name = name
+        self.persona = persona
+        self.persona_status = persona_status
+        self.text_path = text_path
+        self.profile_pic_path = profile_pic_path
+        self.image_status = image_status
+        self.version = version  # Bumped by every edit; the id never changes
+        self.answers = {}
+
+    @classmethod
+    def _load(cls, cursor, where, params):
+        cursor.execute(f'SELECT {", ".join(cls.COLUMNS)} FROM clones WHERE {where}', params)
+        clones = [cls(*row) for row in cursor.fetchall()]
+        answers = Answer.for_clones(cursor, [clone.id for clone in clones])
+        for clone in clones:
+            clone.answers = answers[clone.id]
+        return clones
+
+    @classmethod
+    def by_id(cls, cursor, clone_id):
+        clones = cls._load(cursor, 'id = ?', (clone_id,))
+        return clones[0] if clones else None
+
+    @classmethod
+    def by_user(cls, cursor, user_id):
+        clones = cls._load(cursor, 'user_id = ?', (user_id,))
+        return clones[0] if clones else None
+
+    @classmethod
+    def by_ids(cls, cursor, clone_ids):
+        """{clone id: Clone} for the given ids (missing ones are left out)."""
+        clone_ids = list(clone_ids)
+        if not clone_ids:
+            return {}
+        return {clone.id: clone for clone in cls._load(cursor, f'id IN ({",".join("?" * len(clone_ids))})', clone_ids)}
+
+    def as_match_dict(self):
+        """The shape matching.py and llm.py work with."""
+        return {'id': self.id, 'version': self.version, 'answers': self.answers, 'persona': self.persona, 'name': self.name or 'No_Name'}
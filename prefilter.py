@@ -0,0 +1,66 @@
+# prefilter.py
+# Cheap vectorized prefilter over the Likert questions, used to pick which clones get LLM evaluation.
+
+import numpy as np
+
+from questions import DEFAULT_QUESTIONS
+
+# Questions q1-q16 are 5-point Likert items; each clone is encoded as one int8 per item
+LIKERT_QUESTIONS = [q for q in DEFAULT_QUESTIONS if q['type'] == 'multiple-choice']
+VECTOR_DTYPE = np.int8
+VECTOR_SIZE = len(LIKERT_QUESTIONS)
+EMPTY_VECTOR = bytes(VECTOR_SIZE)  # Stand-in for rows not yet backfilled (every answer skipped)
+
+# Per-question weights for the distance (all equal by default; bump the ones that matter most)
+QUESTION_WEIGHTS = np.ones(VECTOR_SIZE, dtype=np.float32)
+
+
+def encode_answers(answers):
+    """
+    Encode a clone's answers as a compact byte string: 1-5 for the chosen option, 0 for skipped.
+    Stored in clones.answers_vec so ranking never has to parse answers_json.
+    """
+    vec = np.zeros(VECTOR_SIZE, dtype=VECTOR_DTYPE)
+    for i, q in enumerate(LIKERT_QUESTIONS):
+        answer = answers.get(q['id'])
+        if answer in q['options']:
+            vec[i] = q['options'].index(answer) + 1
+    return vec.tobytes()
+
+
+def decode_vectors(blobs):
+    """Stack encoded answer vectors into an (N, VECTOR_SIZE) int8 matrix in one copy."""
+    if not blobs:
+        return np.zeros((0, VECTOR_SIZE), dtype=VECTOR_DTYPE)
+    return np.frombuffer(b''.join(blob or EMPTY_VECTOR for blob in blobs), dtype=VECTOR_DTYPE).reshape(len(blobs), VECTOR_SIZE)
+
+
+def similarity_scores(viewer_vec, matrix, weights=QUESTION_WEIGHTS):
+    """
+    Weighted Likert similarity in [0, 1] between the viewer and every row of `matrix`.
+    Only questions both clones answered count; pairs with no overlap score a neutral 0.5.
+    """
+    if viewer_vec is None or isinstance(viewer_vec, bytes):
+        viewer_vec = np.frombuffer(viewer_vec or EMPTY_VECTOR, dtype=VECTOR_DTYPE)
+    viewer = viewer_vec.astype(np.float32)
+    values = matrix.astype(np.float32)
+    mask = (values > 0) & (viewer > 0)
+    w = mask * weights
+    total = w.sum(axis=1)
+    distance = (np.abs(values - viewer) * w).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = 1.0 - distance / (4.0 * total)  # 4 = largest possible gap on a 1-5 scale
+    return np.where(total > 0, scores, 0.5)
+
+
+def top_k(viewer_vec, matrix, k):
+    """Indices of the `k` best-scoring rows of `matrix`, best first."""
+    n = matrix.shape[0]
+    if n == 0 or k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    scores = similarity_scores(viewer_vec, matrix)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    return idx[np.argsort(-scores[idx], kind='stable')]
@@ -0,0 +1,287 @@
+# rate_limiter.py
+# Cross-process LLM rate limiting: token buckets for requests/minute and tokens/minute kept in
+# SQLite (shared by every gunicorn and worker.py process), an AIMD concurrency window enforced
+# across those processes, and retries with exponential backoff + jitter that honor Retry-After.
+
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STATE_PATH = os.getenv('RATE_LIMIT_PATH', 'rate_limits.db')
+
+# Per-provider limits; override with e.g. GEMINI_RPM=1000 GEMINI_TPM=4000000
+DEFAULT_LIMITS = {
+    'gemini': {'rpm': 300, 'tpm': 1000000},
+    'groq': {'rpm': 30, 'tpm': 12000},
+}
+MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 5))
+BACKOFF_BASE = 1.0  # Seconds before the first retry, doubled on each further attempt
+BACKOFF_CAP = 60.0
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 16))
+START_CONCURRENCY = 4
+# A slot held longer than this (its process crashed or was killed mid-call) is given back
+SLOT_LEASE_SECONDS = float(os.getenv('LLM_SLOT_LEASE_SECONDS', 300))
+SLOT_POLL_SECONDS = 0.1  # How often a call waiting for a free slot checks again
+
+# Exceptions without an HTTP status that are still worth retrying
+TRANSIENT_ERRORS = {'APIConnectionError', 'APITimeoutError', 'ServiceUnavailable', 'DeadlineExceeded',
+                    'ConnectionError', 'TimeoutError', 'ReadTimeout', 'ConnectTimeout'}
+
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def limits_for(provider):
+    defaults = DEFAULT_LIMITS.get(provider, {'rpm': 60, 'tpm': 100000})
+    prefix = provider.upper()
+    return (float(os.getenv(f'{prefix}_RPM', defaults['rpm'])),
+            float(os.getenv(f'{prefix}_TPM', defaults['tpm'])))
+
+
+def _connect():
+    global _initialized
+    conn = sqlite3.connect(STATE_PATH, timeout=30, isolation_level=None)
+    if not _initialized:
+        with _init_lock:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS concurrency (
+                    provider TEXT PRIMARY KEY,
+                    max_in_flight REAL NOT NULL
+                )
+            ''')
+            # One row per call in flight, in any process, counted against the window
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS slots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    provider TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_slots_provider ON slots (provider, expires_at)')
+            _initialized = True
+    return conn
+
+
+# =========================
+# Token buckets
+# =========================
+def _refill(conn, name, capacity, now):
+    row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE name = ?', (name,)).fetchone()
+    tokens, updated_at = row if row else (capacity, now)
+    return min(capacity, tokens + (now - updated_at) * capacity / 60.0)  # Capacity refills over one minute
+
+
+def acquire(provider, est_tokens):
+    """Block until both the requests/minute and tokens/minute buckets admit this call."""
+    rpm, tpm = limits_for(provider)
+    est_tokens = min(est_tokens, tpm)  # A single oversized request still gets through eventually
+    while True:
+        conn = _connect()
+        try:
+            # BEGIN outside the inner try: if it fails there is nothing to roll back
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                requests = _refill(conn, f'{provider}:rpm', rpm, now)
+                tokens = _refill(conn, f'{provider}:tpm', tpm, now)
+                # Check both buckets before taking from either
+                wait = max((1 - requests) * 60.0 / rpm if requests < 1 else 0.0,
+                           (est_tokens - tokens) * 60.0 / tpm if tokens < est_tokens else 0.0)
+                if wait == 0:
+                    requests -= 1
+                    tokens -= est_tokens
+                conn.executemany('INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)',
+                                 [(f'{provider}:rpm', requests, now), (f'{provider}:tpm', tokens, now)])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+        if wait == 0:
+            return
+        time.sleep(min(wait, 5.0) + random.uniform(0, 0.05))
+
+
+# =========================
+# AIMD concurrency window
+# =========================
+def _adjust_window(provider, throttled):
+    # Additive increase (about +1 per window's worth of successes), multiplicative decrease
+    conn = _connect()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT max_in_flight FROM concurrency WHERE provider = ?', (provider,)).fetchone()
+            window = row[0] if row else START_CONCURRENCY
+            if throttled:
+                window = max(MIN_CONCURRENCY, window / 2)
+            else:
+                window = min(MAX_CONCURRENCY, window + 1.0 / window)
+            conn.execute('INSERT OR REPLACE INTO concurrency (provider, max_in_flight) VALUES (?, ?)',
+                         (provider, window))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+
+
+def _try_take_slot(conn, provider):
+    """Take a slot if fewer than `window` calls are in flight across all processes; returns its id or None."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        now = time.time()
+        conn.execute('DELETE FROM slots WHERE provider = ? AND expires_at < ?', (provider, now))
+        in_flight = conn.execute('SELECT COUNT(*) FROM slots WHERE provider = ?', (provider,)).fetchone()[0]
+        row = conn.execute('SELECT max_in_flight FROM concurrency WHERE provider = ?', (provider,)).fetchone()
+        slot_id = None
+        if in_flight < int(row[0] if row else START_CONCURRENCY):
+            slot_id = conn.execute('INSERT INTO slots (provider, pid, expires_at) VALUES (?, ?, ?)',
+                                   (provider, os.getpid(), now + SLOT_LEASE_SECONDS)).lastrowid
+        conn.execute('COMMIT')
+        return slot_id
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _enter(provider):
+    """Block until a concurrency slot is free; returns the slot id to pass to _exit."""
+    conn = _connect()
+    try:
+        while True:
+            slot_id = _try_take_slot(conn, provider)
+            if slot_id is not None:
+                return slot_id
+            time.sleep(SLOT_POLL_SECONDS * random.uniform(0.5, 1.5))
+    finally:
+        conn.close()
+
+
+def _exit(slot_id):
+    conn = _connect()
+    try:
+        conn.execute('DELETE FROM slots WHERE id = ?', (slot_id,))
+    finally:
+        conn.close()
+
+
+# =========================
+# Retries
+# =========================
+def _status_of(error):
+    for attr in ('status_code', 'code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def _retry_after(error):
+    """Server-suggested delay in seconds, from a Retry-After header or a gRPC RetryInfo detail."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        value = headers.get('retry-after')
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+    for detail in getattr(error, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+
+def is_retryable(error):
+    status = _status_of(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in TRANSIENT_ERRORS
+
+
+def estimate_tokens(text, max_tokens=None):
+    # ~4 characters per token for the prompt, plus the completion budget
+    return len(text or '') // 4 + (max_tokens or 500)
+
+
+def call_with_retries(provider, func, est_tokens=1000, max_retries=MAX_RETRIES):
+    """Run `func()` under the shared rate limits, retrying 429s, 5xx and transient network errors."""
+    for attempt in range(max_retries + 1):
+        acquire(provider, est_tokens)
+        slot_id = _enter(provider)
+        try:
+            return_value = func()
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            _exit(slot_id)
+
+        if error is None:
+            _adjust_window(provider, throttled=False)
+            return return_value
+        _retry_or_raise(provider, error, attempt, max_retries)
+
+
+def stream_with_retries(provider, open_stream, est_tokens=1000, max_retries=MAX_RETRIES):
+    """
+    Yield the chunks of `open_stream()` under the shared rate limits. The concurrency slot is held
+    until the stream is exhausted or closed. Failures before the first chunk are retried like
+    call_with_retries; errors mid-stream propagate.
+    """
+    for attempt in range(max_retries + 1):
+        acquire(provider, est_tokens)
+        slot_id = _enter(provider)
+        started = False
+        try:
+            for chunk in open_stream():
+                started = True
+                yield chunk
+            error = None
+        except Exception as e:
+            if started:
+                raise
+            error = e
+        finally:
+            _exit(slot_id)
+
+        if error is None:
+            _adjust_window(provider, throttled=False)
+            return
+        _retry_or_raise(provider, error, attempt, max_retries)
+
+
+def _retry_or_raise(provider, error, attempt, max_retries):
+    # After a failed attempt: re-raise if it can't be retried, otherwise back off before the next one
+    if not is_retryable(error):
+        raise error
+    _adjust_window(provider, throttled=True)
+    if attempt == max_retries:
+        raise error
+    delay = _retry_after(error)
+    if delay is None:
+        delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+    metrics.note_retry()
+    logger.warning('%s call failed (%s), retry %d/%d in %.1fs', provider, type(error).__name__, attempt + 1, max_retries,
+                   delay)
+    time.sleep(delay)
@@ -1,15 +1,16 @@
-import sqlite3
+from db import connect
 from models import init_db  # Assumes models.py is in the same directory
 
 # Connect to the database and drop tables
-conn = sqlite3.connect('users.db')
+conn = connect()
 cursor = conn.cursor()
-cursor.execute('DROP TABLE IF EXISTS clones')
-cursor.execute('DROP TABLE IF EXISTS users')
+for table in ('top_matches', 'matches', 'jobs', 'answers', 'clone_history', 'clones', 'users'):
+    cursor.execute(f'DROP TABLE IF EXISTS {table}')
+cursor.execute('PRAGMA user_version = 0')  # Migrations start over
 conn.commit()
 conn.close()
 
 # Recreate tables via init_db
 init_db()
 
-print('Database reset: All users and clones deleted. Tables recreated.')
\ No newline at end of file
+print('Database reset: All users and clones deleted. Tables recreated.')
@@ -0,0 +1,94 @@
+# storage.py
+# Content-addressed upload storage.
+#
+# Every stored file is named after the SHA-256 of its bytes: uploads/<first 2 hex>/<sha256>.<ext>.
+# Two users uploading the same "photo.jpg" can't overwrite each other, identical files are kept
+# once, and a stored file never changes, so it can be served with a strong ETag and
+# "Cache-Control: immutable". Files are written to a temp file and renamed into place, so a
+# reader never sees a partial file.
+
+import hashlib
+import os
+import re
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+
+# "ab/ab12...ef.png" (and derivatives like "ab/ab12...ef.w320.webp"), relative to the upload folder
+CONTENT_NAME_RE = re.compile(r'^([0-9a-f]{2})/(\1[0-9a-f]{62})((?:\.[a-z0-9]+)+)$')
+
+
+def content_path(root, digest, ext):
+    return os.path.join(root, digest[:2], f'{digest}.{ext}')
+
+
+def _commit(tmp_path, path):
+    # Dedupe on write: if the content is already stored, the new copy is dropped
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+    return path
+
+
+def _temp_file(directory):
+    # In the destination file system, so the final rename is atomic
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    os.chmod(tmp_path, 0o644)  # mkstemp creates 0600 files; the front-end server may need to read them
+    return os.fdopen(fd, 'wb'), tmp_path
+
+
+def store_bytes(data, ext, root):
+    """Store `data` under its content hash; returns (path, sha256 hex digest)."""
+    digest = hashlib.sha256(data).hexdigest()
+    path = content_path(root, digest, ext)
+    if os.path.exists(path):
+        return path, digest
+    f, tmp_path = _temp_file(os.path.dirname(path))
+    with f:
+        f.write(data)
+    return _commit(tmp_path, path), digest
+
+
+def store_stream(stream, ext, root):
+    """Store a file-like object in one streaming pass (hashing while writing); returns (path, digest)."""
+    digest = hashlib.sha256()
+    f, tmp_path = _temp_file(root)
+    try:
+        with f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        path = content_path(root, digest.hexdigest(), ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return _commit(tmp_path, path), digest.hexdigest()
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_once(path, write):
+    """
+    Create a file that never changes once it exists (e.g. a derivative of a stored file): `write(f)`
+    fills a temp file that is renamed into place. Returns False, writing nothing, if `path` exists.
+    """
+    if os.path.exists(path):
+        return False
+    f, tmp_path = _temp_file(os.path.dirname(path))
+    try:
+        with f:
+            write(f)
+        _commit(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def content_etag(filename):
+    """Strong ETag for a content-addressed name relative to the upload folder, or None for legacy files."""
+    match = CONTENT_NAME_RE.match(filename)
+    return match.group(2) + match.group(3) if match else None
@@ -0,0 +1,170 @@
+# tasks.py
+# Background job handlers run by worker.py (persona generation, profile picture compositing,
+# pairwise match evaluation, top-match list refreshes).
+
+import logging
+import os
+
+from candidates import ranked_candidates, load_candidates
+from db import get_db
+from imaging import composite_to_store
+from jobs import handler, enqueue
+from llm import generate_persona, patch_persona
+from matching import evaluate_candidate, evaluate_candidates, load_match, DEFAULT_MAX_WORKERS
+from models import Clone
+import top_matches
+
+logger = logging.getLogger(__name__)
+
+
+def load_clone(clone_id):
+    """Fetch a clone as the dict shape matching.py works with, or None if it no longer exists."""
+    clone = Clone.by_id(get_db().cursor(), clone_id)
+    if clone is None:
+        return None
+    return dict(clone.as_match_dict(), text_path=clone.text_path)
+
+
+def set_clone_status(clone_id, column, status, expect=None, **values):
+    """
+    Set `column` (persona_status or image_status) and any extra clone columns in one update.
+    `expect` ({column: value}, e.g. {'version': 3}) skips the update if the clone has changed since
+    the work started, so a stale result never overwrites a newer one.
+    """
+    assignments = ''.join(f', {name} = ?' for name in values)
+    conditions = ''.join(f' AND {name} = ?' for name in expect or {})
+    conn = get_db()
+    conn.execute(f'UPDATE clones SET {column} = ?{assignments} WHERE id = ?{conditions}',
+                 (status, *values.values(), clone_id, *(expect or {}).values()))
+    conn.commit()
+
+
+def refresh_top_matches(clone_id, version, shortlist=top_matches.SHORTLIST, pool=top_matches.SAMPLE_POOL,
+                        enqueue=None, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Re-score only the pairs this version of the clone affects and merge them into the top-match lists:
+    its prefilter shortlist, plus the clones whose lists held its previous version. Cached pairs are
+    merged right away. Uncached ones are handed to `enqueue` (evaluate_match jobs) or, without it,
+    scored on the matching pool; either way save_match merges them when they finish.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    clone = Clone.by_id(cursor, clone_id)
+    if clone is None or clone.version != version or clone.persona_status != 'ready':
+        return  # Edited again since (that version gets its own refresh) or not matchable yet
+    cursor.execute('SELECT answers_vec FROM clones WHERE id = ?', (clone_id,))
+    candidate_ids = ranked_candidates(cursor, cursor.fetchone()[0], clone.user_id, shortlist, pool=pool, seed=clone_id)
+    for other_id in top_matches.lists_with_stale(cursor, clone_id, version):
+        if other_id not in candidate_ids:
+            candidate_ids.append(other_id)
+    top_matches.drop_stale(cursor, clone_id, version)
+    conn.commit()
+
+    user = clone.as_match_dict()
+    candidates = [c for c in load_candidates(cursor, candidate_ids) if c['persona']]
+    results = evaluate_candidates(user, candidates, deadline=None, max_workers=max_workers, enqueue=enqueue)
+    for result in results:
+        if result['status'] == 'done' and result['score'] is not None:
+            top_matches.merge(cursor, user, result['candidate'], result['score'])
+    # date_clones won't start another refresh for this version, even if no candidates turned up
+    cursor.execute('UPDATE clones SET top_matches_version = ? WHERE id = ? AND version = ?',
+                   (version, clone_id, version))
+    conn.commit()
+    logger.info('Refreshed top matches for clone %s: %d pairs', clone_id, len(candidates))
+
+
+# =========================
+# Enqueue helpers (web side)
+# =========================
+def enqueue_persona(clone_id, version, base_persona=None, changed=None):
+    # Persona generation gates everything else for this clone, so it jumps the queue.
+    # With `base_persona`, the persona is patched for the `changed` answers instead of rebuilt.
+    # One job per clone version: a job for an older version finds the clone edited and does nothing.
+    payload = {'clone_id': clone_id, 'version': version}
+    if base_persona is not None:
+        payload.update(base_persona=base_persona, changed=changed)
+    return enqueue('generate_persona', payload, priority=10, dedupe_key=f'persona:{clone_id}:{version}')
+
+
+def enqueue_composite(clone_id, image_hash, staged_path, upload_folder):
+    # The upload is staged on disk (not in the payload) and removed once the job is done or dead
+    return enqueue('composite_profile_pic',
+                   {'clone_id': clone_id, 'image_hash': image_hash, 'staged_path': staged_path,
+                    'upload_folder': upload_folder},
+                   priority=10, max_attempts=3, dedupe_key=f'image:{clone_id}:{image_hash}')
+
+
+def enqueue_refresh(clone_id, version):
+    # Runs once the clone's persona is ready; its pair evaluations are queued behind it
+    return enqueue('refresh_top_matches', {'clone_id': clone_id, 'version': version}, priority=5,
+                   dedupe_key=f'top:{clone_id}:{version}')
+
+
+def enqueue_match(user, other):
+    return enqueue('evaluate_match', {'viewer_clone_id': user['id'], 'other_clone_id': other['id']},
+                   dedupe_key=f'match:{user["id"]}:{other["id"]}')
+
+
+# =========================
+# Handlers (worker side)
+# =========================
+def persona_failed(payload):
+    set_clone_status(payload['clone_id'], 'persona_status', 'failed',
+                     expect={'version': payload['version']} if 'version' in payload else None)
+
+
+@handler('generate_persona', on_dead=persona_failed)
+def run_generate_persona(payload):
+    clone = load_clone(payload['clone_id'])
+    if clone is None or clone['version'] != payload.get('version', clone['version']):
+        return  # Clone was deleted or edited again before we got to it
+    if payload.get('base_persona') is not None:
+        changed = {q_id: tuple(values) for q_id, values in payload['changed'].items()}
+        persona = patch_persona(payload['base_persona'], changed)
+    else:
+        persona = generate_persona(clone['answers'], clone['text_path'])
+    set_clone_status(clone['id'], 'persona_status', 'ready', expect={'version': clone['version']},
+                     persona=persona)
+    logger.info('Generated persona for clone %s', clone['id'])
+    enqueue_refresh(clone['id'], clone['version'])
+
+
+def composite_failed(payload):
+    set_clone_status(payload['clone_id'], 'image_status', 'failed',
+                     expect={'image_hash': payload['image_hash'], 'image_status': 'pending'})
+    if os.path.exists(payload['staged_path']):
+        os.remove(payload['staged_path'])
+
+
+@handler('composite_profile_pic', on_dead=composite_failed)
+def run_composite_profile_pic(payload):
+    cursor = get_db().cursor()
+    cursor.execute('SELECT image_hash, image_status FROM clones WHERE id = ?', (payload['clone_id'],))
+    row = cursor.fetchone()
+    if row == (payload['image_hash'], 'pending'):
+        with open(payload['staged_path'], 'rb') as f:
+            data = f.read()
+        composite_path = composite_to_store(data, payload['upload_folder'])
+        # Unless a different picture was uploaded in the meantime
+        set_clone_status(payload['clone_id'], 'image_status', 'ready', expect={'image_hash': payload['image_hash']},
+                         profile_pic_path=composite_path)
+        logger.info('Composited profile picture for clone %s', payload['clone_id'])
+    # Also when the clone is gone, has a newer picture or this upload was already composited (a retry)
+    if os.path.exists(payload['staged_path']):
+        os.remove(payload['staged_path'])
+
+
+@handler('evaluate_match')
+def run_evaluate_match(payload):
+    user = load_clone(payload['viewer_clone_id'])
+    other = load_clone(payload['other_clone_id'])
+    if user is None or other is None or not user['persona'] or not other['persona']:
+        return
+    if load_match(user, other) is not None:
+        return  # Already evaluated, possibly from the other clone's side
+    evaluate_candidate(user, other)  # Writes the result to the matches cache and both top-match lists
+
+
+@handler('refresh_top_matches')
+def run_refresh_top_matches(payload):
+    refresh_top_matches(payload['clone_id'], payload['version'], enqueue=enqueue_match)
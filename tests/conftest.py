@@ -0,0 +1,48 @@
+# tests/conftest.py
+# Every test runs in its own temp directory: users.db, llm_cache.db and rate_limits.db are created
+# there, and cached per-thread connections are dropped, so the repo's users.db is never touched.
+
+import os
+import threading
+
+import pytest
+
+os.environ.setdefault('LLM_BACKEND', 'fake')  # Never reach a real model from the tests
+
+import db
+import llm_cache
+import rate_limiter
+from migrations import migrate
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # db.DB_PATH is relative
+    monkeypatch.setattr(db, '_local', threading.local())
+    monkeypatch.setattr(llm_cache, 'CACHE_PATH', str(tmp_path / 'llm_cache.db'))
+    monkeypatch.setattr(rate_limiter, 'STATE_PATH', str(tmp_path / 'rate_limits.db'))
+    monkeypatch.setattr(rate_limiter, '_initialized', False)
+    return tmp_path
+
+
+@pytest.fixture
+def conn(workdir):
+    """This thread's connection to a users.db migrated to the latest schema."""
+    conn = db.thread_db(autocommit=True)
+    migrate(conn)
+    return conn
+
+
+@pytest.fixture
+def make_clone(conn):
+    """make_clone(id) inserts a user and a ready clone with that id; returns it as a match dict."""
+    def make(clone_id, name=None):
+        conn.execute("INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'x')",
+                     (clone_id, f'user{clone_id}'))
+        conn.execute('''
+            INSERT INTO clones (id, user_id, name, answers_json, persona, persona_status)
+            VALUES (?, ?, ?, '{}', 'A persona.', 'ready')
+        ''', (clone_id, clone_id, name or f'Clone {clone_id}'))
+        return {'id': clone_id, 'version': 1, 'name': name or f'Clone {clone_id}', 'answers': {},
+                'persona': 'A persona.'}
+    return make
@@ -0,0 +1,81 @@
+# tests/test_jobs.py
+# Claiming, retrying and dead-lettering in the SQLite job queue (jobs.py).
+
+import time
+
+import jobs
+
+
+def _job(conn, job_id):
+    return conn.execute('SELECT status, attempts, locked_by FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+def test_claim_takes_highest_priority_first(conn):
+    low = jobs.enqueue('probe', {'n': 1})
+    high = jobs.enqueue('probe', {'n': 2}, priority=5)
+    assert jobs.claim('A')[0] == high
+    assert jobs.claim('A')[0] == low
+    assert jobs.claim('A') is None
+
+
+def test_dedupe_key_allows_one_live_job(conn):
+    assert jobs.enqueue('probe', {}, dedupe_key='k') is not None
+    assert jobs.enqueue('probe', {}, dedupe_key='k') is None
+
+
+def test_expired_lease_is_claimed_again(conn):
+    job_id = jobs.enqueue('probe', {'n': 1})
+    assert jobs.claim('A', lease_seconds=-1) == (job_id, 'probe', {'n': 1}, 1)
+    assert jobs.claim('B') == (job_id, 'probe', {'n': 1}, 2)
+    assert _job(conn, job_id) == ('running', 2, 'B')
+
+
+def test_only_the_lease_holder_can_complete_or_fail(conn):
+    job_id = jobs.enqueue('probe', {})
+    jobs.claim('A', lease_seconds=-1)
+    jobs.claim('B')
+    assert not jobs.complete(job_id, 'A')
+    assert not jobs.fail(job_id, 'A', 1, 'late failure')
+    assert not jobs.extend_lease(job_id, 'A')
+    assert _job(conn, job_id) == ('running', 2, 'B')
+    assert jobs.complete(job_id, 'B')
+    assert _job(conn, job_id)[0] == 'done'
+
+
+def test_fail_retries_with_backoff_then_dead_letters(conn):
+    job_id = jobs.enqueue('probe', {}, max_attempts=2)
+    _, _, _, attempts = jobs.claim('A')
+    assert not jobs.fail(job_id, 'A', attempts, 'boom')
+    status, run_at = conn.execute('SELECT status, run_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    assert status == 'queued' and run_at > time.time()
+    assert jobs.claim('A') is None  # Backing off
+
+    conn.execute('UPDATE jobs SET run_at = 0 WHERE id = ?', (job_id,))
+    _, _, _, attempts = jobs.claim('A')
+    assert jobs.fail(job_id, 'A', attempts, 'boom again')
+    assert _job(conn, job_id) == ('dead', 2, None)
+
+
+def test_expired_lease_on_last_attempt_is_dead_lettered(conn, monkeypatch):
+    dead = []
+    monkeypatch.setitem(jobs.DEAD_HANDLERS, 'probe', dead.append)
+    job_id = jobs.enqueue('probe', {'n': 1}, max_attempts=1)
+    jobs.claim('A', lease_seconds=-1)  # Worker A is killed mid-job
+    assert jobs.claim('B') is None
+    assert _job(conn, job_id) == ('dead', 1, None)
+    assert dead == [{'n': 1}]
+
+
+def test_run_job_completes_or_fails(conn, monkeypatch):
+    ran, dead = [], []
+    monkeypatch.setitem(jobs.HANDLERS, 'probe', ran.append)
+    monkeypatch.setitem(jobs.HANDLERS, 'broken', lambda payload: 1 / 0)
+    monkeypatch.setitem(jobs.DEAD_HANDLERS, 'broken', dead.append)
+    ok = jobs.enqueue('probe', {'n': 1})
+    broken = jobs.enqueue('broken', {'n': 2}, max_attempts=1)
+
+    jobs.run_job(*jobs.claim('A', ['probe']), worker_id='A')
+    jobs.run_job(*jobs.claim('A', ['broken']), worker_id='A')
+    assert ran == [{'n': 1}] and _job(conn, ok)[0] == 'done'
+    assert dead == [{'n': 2}] and _job(conn, broken)[0] == 'dead'
+    assert 'ZeroDivisionError' in conn.execute('SELECT last_error FROM jobs WHERE id = ?', (broken,)).fetchone()[0]
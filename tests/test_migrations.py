@@ -0,0 +1,112 @@
+# tests/test_migrations.py
+# Upgrading databases from the original schema (before migrations.py existed) to the latest version.
+
+import json
+import sqlite3
+
+import pytest
+
+import db
+import migrations
+from prefilter import encode_answers
+
+# models.init_db before the migration runner; older databases also still had llm_conversation
+BASELINE_SCHEMA = '''
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL
+    );
+    CREATE TABLE clones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        answers_json TEXT NOT NULL,
+        text_path TEXT,
+        persona TEXT,
+        profile_pic_path TEXT,
+        name TEXT NOT NULL,
+        {extra_columns}
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+'''
+
+ANSWERS = {'q1': 'Completely agree', 'q2': 'Disagree', 'q17': 'Tacos', 'q3': None}
+
+
+def _baseline_db(extra_columns=''):
+    conn = sqlite3.connect('users.db')
+    conn.executescript(BASELINE_SCHEMA.format(extra_columns=extra_columns))
+    conn.executemany('INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+                     [(1, 'alice', 'x'), (2, 'bobby', 'x')])
+    # alice re-created her clone (the old create_clone inserted a second row); bobby's persona never finished
+    conn.executemany('''
+        INSERT INTO clones (id, user_id, answers_json, persona, profile_pic_path, name) VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(1, 1, json.dumps({'q1': 'Neutral'}), 'Old persona.', None, 'Alice v0'),
+          (2, 1, json.dumps(ANSWERS), 'A persona.', 'Uploads/alice.png', 'Alice'),
+          (3, 2, json.dumps({}), None, None, 'Bobby')])
+    conn.commit()
+    conn.close()
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+@pytest.mark.parametrize('extra_columns', ['', 'llm_conversation TEXT,'])
+def test_baseline_database_migrates_to_head(workdir, extra_columns):
+    _baseline_db(extra_columns)
+    conn = db.connect(autocommit=True)
+    assert migrations.migrate(conn) == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.current_version(conn) == migrations.LATEST_VERSION
+
+    # One clone per user, the newest kept
+    rows = conn.execute('''
+        SELECT id, user_id, profile_pic_path, persona_status, image_status, answers_vec, version, sample_key
+        FROM clones ORDER BY id
+    ''').fetchall()
+    assert [row[:2] for row in rows] == [(2, 1), (3, 2)]
+    alice, bobby = rows
+    assert alice[2] == 'uploads/alice.png'
+    assert (alice[3], alice[4], bobby[3], bobby[4]) == ('ready', 'ready', 'pending', None)
+    assert alice[5] == encode_answers(ANSWERS) and bobby[5] == encode_answers({})
+    assert alice[6] == bobby[6] == 1
+    assert None not in (alice[7], bobby[7])
+    assert 'llm_conversation' not in _columns(conn, 'clones')
+
+    # Answers normalized: Likert answers as 1-5, free text as text, skipped ones kept as NULL
+    assert conn.execute('SELECT question_id, value, text FROM answers WHERE clone_id = 2 ORDER BY question_id').fetchall() \
+        == [('q1', 5, None), ('q17', None, 'Tacos'), ('q2', 2, None), ('q3', None, None)]
+    conn.close()
+
+
+def test_migrated_schema_matches_a_fresh_one(workdir):
+    _baseline_db('llm_conversation TEXT,')
+    upgraded = db.connect(autocommit=True)
+    migrations.migrate(upgraded)
+    fresh = db.connect(str(workdir / 'fresh.db'), autocommit=True)
+    migrations.migrate(fresh)
+
+    def schema(conn):
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return {table: _columns(conn, table) for table in tables}, \
+            {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+    assert schema(upgraded) == schema(fresh)
+
+
+def test_migrate_is_idempotent(workdir):
+    _baseline_db()
+    conn = db.connect(autocommit=True)
+    migrations.migrate(conn)
+    assert migrations.migrate(conn) == []
+
+
+def test_failed_migration_leaves_the_previous_version(workdir, monkeypatch):
+    def broken(cursor):
+        cursor.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('boom')
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [(99, 'broken', broken)])
+    conn = db.connect(autocommit=True)
+    with pytest.raises(RuntimeError):
+        migrations.migrate(conn)
+    assert migrations.current_version(conn) == migrations.LATEST_VERSION
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'half_done'").fetchone()[0] == 0
@@ -0,0 +1,108 @@
+# tests/test_rate_limiter.py
+# The shared AIMD concurrency window and retries in rate_limiter.py.
+
+import sqlite3
+
+import pytest
+
+import rate_limiter
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def _window(provider):
+    conn = sqlite3.connect(rate_limiter.STATE_PATH)
+    row = conn.execute('SELECT max_in_flight FROM concurrency WHERE provider = ?', (provider,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def _slots(provider):
+    conn = sqlite3.connect(rate_limiter.STATE_PATH)
+    count = conn.execute('SELECT COUNT(*) FROM slots WHERE provider = ?', (provider,)).fetchone()[0]
+    conn.close()
+    return count
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(workdir, monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, 'sleep', lambda seconds: None)
+
+
+def test_window_halves_when_throttled_down_to_the_minimum():
+    rate_limiter._adjust_window('p', throttled=True)
+    assert _window('p') == rate_limiter.START_CONCURRENCY / 2
+    for _ in range(5):
+        rate_limiter._adjust_window('p', throttled=True)
+    assert _window('p') == rate_limiter.MIN_CONCURRENCY
+
+
+def test_window_grows_by_about_one_per_window_of_successes():
+    rate_limiter._adjust_window('p', throttled=True)
+    rate_limiter._adjust_window('p', throttled=True)
+    assert _window('p') == 1
+    rate_limiter._adjust_window('p', throttled=False)
+    assert _window('p') == 2
+    rate_limiter._adjust_window('p', throttled=False)
+    rate_limiter._adjust_window('p', throttled=False)
+    assert _window('p') == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+
+
+def test_window_never_exceeds_the_maximum(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'MAX_CONCURRENCY', 5)
+    for _ in range(50):
+        rate_limiter._adjust_window('p', throttled=False)
+    assert _window('p') == 5
+
+
+def test_slots_are_limited_by_the_window():
+    conn = rate_limiter._connect()
+    taken = [rate_limiter._try_take_slot(conn, 'p') for _ in range(rate_limiter.START_CONCURRENCY + 1)]
+    assert None not in taken[:-1] and taken[-1] is None
+    rate_limiter._exit(taken[0])
+    assert rate_limiter._try_take_slot(conn, 'p') is not None
+    conn.close()
+
+
+def test_throttled_call_shrinks_the_window_and_is_retried():
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) == 1:
+            raise Throttled()
+        return 'ok'
+
+    assert rate_limiter.call_with_retries('p', func) == 'ok'
+    assert len(calls) == 2
+    half = rate_limiter.START_CONCURRENCY / 2
+    assert _window('p') == half + 1 / half
+    assert _slots('p') == 0
+
+
+def test_client_errors_are_not_retried():
+    calls = []
+
+    def func():
+        calls.append(1)
+        raise BadRequest()
+
+    with pytest.raises(BadRequest):
+        rate_limiter.call_with_retries('p', func)
+    assert len(calls) == 1 and _window('p') is None and _slots('p') == 0
+
+
+def test_stream_holds_its_slot_until_closed():
+    stream = rate_limiter.stream_with_retries('p', lambda: iter(['a', 'b', 'c']))
+    assert next(stream) == 'a'
+    assert _slots('p') == 1
+    stream.close()
+    assert _slots('p') == 0
+    assert list(rate_limiter.stream_with_retries('p', lambda: iter(['a', 'b']))) == ['a', 'b']
+    assert _slots('p') == 0
@@ -0,0 +1,134 @@
+# tests/test_top_matches.py
+# One conversation and score per pair (matching.save_match) behind both clones' precomputed lists
+# (top_matches.py), and how the lists treat entries made with an older clone version.
+
+import threading
+
+import pytest
+
+import top_matches
+from db import thread_db
+from matching import invalidate_matches, load_match, save_match
+
+
+def _list(conn, clone_id):
+    return conn.execute('SELECT other_clone_id, clone_version, other_version, score FROM top_matches '
+                        'WHERE clone_id = ? ORDER BY other_clone_id', (clone_id,)).fetchall()
+
+
+def _bump(conn, clone):
+    # What create_clone does on an edit
+    conn.execute('UPDATE clones SET version = version + 1 WHERE id = ?', (clone['id'],))
+    invalidate_matches(conn.cursor(), clone['id'], clone['version'] + 1)
+    return dict(clone, version=clone['version'] + 1)
+
+
+# =========================
+# save_match
+# =========================
+def test_first_evaluation_of_a_pair_wins(conn, make_clone):
+    alice, bobby = make_clone(1), make_clone(2)
+    assert save_match(alice, bobby, 'hi\nhello', 50.0)
+    assert not save_match(alice, bobby, 'other\ntake', 90.0)
+    assert load_match(alice, bobby) == {'conversation': 'hi\nhello', 'score': 50.0, 'reversed': False}
+    assert _list(conn, 1) == [(2, 1, 1, 50.0)] and _list(conn, 2) == [(1, 1, 1, 50.0)]
+
+
+def test_evaluation_from_the_other_side_is_refused(conn, make_clone):
+    alice, bobby = make_clone(1), make_clone(2)
+    assert save_match(alice, bobby, 'hi\nhello', 50.0)
+    assert not save_match(bobby, alice, 'yo\nhey', 90.0)
+    # Bobby sees alice's conversation, with alice speaking first
+    assert load_match(bobby, alice) == {'conversation': 'hi\nhello', 'score': 50.0, 'reversed': True}
+    assert _list(conn, 1) == [(2, 1, 1, 50.0)] and _list(conn, 2) == [(1, 1, 1, 50.0)]
+
+
+@pytest.mark.parametrize('round_', range(5))
+def test_concurrent_evaluations_from_both_sides_keep_one(conn, make_clone, round_):
+    alice, bobby = make_clone(1), make_clone(2)
+    barrier = threading.Barrier(2)
+    saved = {}
+
+    def save(tag, user, other, conversation, score):
+        barrier.wait()
+        saved[tag] = save_match(user, other, conversation, score)
+        thread_db().close()
+
+    threads = [threading.Thread(target=save, args=('forward', alice, bobby, 'a', 10.0)),
+               threading.Thread(target=save, args=('reverse', bobby, alice, 'b', 20.0))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(saved.values()) == [False, True]
+    winner = load_match(alice, bobby)
+    assert conn.execute('SELECT COUNT(*) FROM matches').fetchone()[0] == 1
+    # Both lists hold the score of the one conversation either clone is shown
+    assert _list(conn, 1)[0][3] == _list(conn, 2)[0][3] == winner['score']
+    assert winner['reversed'] == saved['reverse']
+
+
+def test_newer_version_replaces_the_pair(conn, make_clone):
+    alice, bobby = make_clone(1), make_clone(2)
+    save_match(alice, bobby, 'old', 50.0)
+    bobby_v2 = _bump(conn, bobby)
+    assert save_match(bobby_v2, alice, 'new', 70.0)
+    assert not save_match(alice, bobby, 'stale', 99.0)  # An evaluation of the old version landing late
+    assert load_match(alice, bobby_v2) == {'conversation': 'new', 'score': 70.0, 'reversed': True}
+    assert load_match(alice, bobby) is None
+    assert conn.execute('SELECT viewer_clone_id, viewer_version, other_version FROM matches').fetchall() == [(2, 2, 1)]
+    assert _list(conn, 1) == [(2, 1, 2, 70.0)] and _list(conn, 2) == [(1, 2, 1, 70.0)]
+
+
+# =========================
+# top_matches
+# =========================
+def test_list_skips_entries_for_replaced_versions(conn, make_clone):
+    alice, bobby, carol = make_clone(1), make_clone(2), make_clone(3)
+    cursor = conn.cursor()
+    top_matches.merge(cursor, alice, bobby, 80.0)
+    top_matches.merge(cursor, alice, carol, 60.0)
+    assert [m['id'] for m in top_matches.load_top_matches(cursor, 1, 1)] == [2, 3]
+
+    _bump(conn, bobby)
+    assert [m['id'] for m in top_matches.load_top_matches(cursor, 1, 1)] == [3]
+    assert top_matches.lists_with_stale(cursor, 2, 2) == [1]
+    top_matches.drop_stale(cursor, 2, 2)
+    assert top_matches.lists_with_stale(cursor, 2, 2) == []
+    assert [row[0] for row in _list(conn, 1)] == [3] and _list(conn, 2) == []
+
+
+def test_list_of_an_older_clone_version_is_not_shown(conn, make_clone):
+    alice, bobby, carol = make_clone(1), make_clone(2), make_clone(3)
+    cursor = conn.cursor()
+    top_matches.merge(cursor, alice, bobby, 80.0)
+    alice_v2 = _bump(conn, alice)
+    assert top_matches.load_top_matches(cursor, 1, 2) == []
+    # Merging anything for the new version drops the old version's entries from its list
+    top_matches.merge(cursor, alice_v2, carol, 40.0)
+    assert _list(conn, 1) == [(3, 2, 1, 40.0)]
+
+
+def test_merge_keeps_the_score_of_the_same_versions(conn, make_clone):
+    alice, bobby = make_clone(1), make_clone(2)
+    cursor = conn.cursor()
+    top_matches.merge(cursor, alice, bobby, 80.0)
+    top_matches.merge(cursor, bobby, alice, 10.0)
+    assert _list(conn, 1) == [(2, 1, 1, 80.0)] and _list(conn, 2) == [(1, 1, 1, 80.0)]
+
+
+def test_trim_counts_only_current_entries(conn, make_clone, monkeypatch):
+    monkeypatch.setattr(top_matches, 'TOP_N', 2)
+    alice = make_clone(1)
+    others = [make_clone(i) for i in range(2, 6)]
+    cursor = conn.cursor()
+    top_matches.merge(cursor, alice, others[0], 99.0)
+    _bump(conn, others[0])  # Clone 2 edited: its high-scoring entry is stale until re-scored
+    top_matches.merge(cursor, alice, others[1], 50.0)
+    top_matches.merge(cursor, alice, others[2], 40.0)
+    assert [m['id'] for m in top_matches.load_top_matches(cursor, 1, 1)] == [3, 4]
+
+    top_matches.merge(cursor, alice, others[3], 45.0)
+    assert [m['id'] for m in top_matches.load_top_matches(cursor, 1, 1)] == [3, 5]
+    assert top_matches.lists_with_stale(cursor, 2, 2) == [1]  # Kept for clone 2's refresh
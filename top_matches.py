@@ -0,0 +1,84 @@
+# top_matches.py
+# Precomputed match lists (the `top_matches` table), so date_clones is one indexed read.
+#
+# Each ready clone has a list of its TOP_N best-scored other clones. The lists are maintained
+# incrementally: every pair the LLM scores (matching.save_match) is merged into both clones' lists,
+# which are then trimmed back to TOP_N. When a clone's persona becomes ready, tasks.refresh_top_matches
+# re-scores only the pairs its edit affects.
+#
+# Rows record both clones' versions. A row made with a version that has since been replaced is
+# skipped by the read and dropped by the next refresh of that clone.
+
+import os
+
+from candidates import DEFAULT_POOL
+
+TOP_N = int(os.getenv('TOP_MATCHES', 10))  # Length of each clone's list
+# Same settings (and environment variables) as app.py's MATCH_CANDIDATES / MATCH_SAMPLE_POOL, for worker.py
+SHORTLIST = int(os.getenv('MATCH_CANDIDATES', 5))  # Prefilter winners sent to the LLM per refresh
+SAMPLE_POOL = int(os.getenv('MATCH_SAMPLE_POOL', DEFAULT_POOL))  # Clones the prefilter ranks per refresh
+
+
+def merge(cursor, user, other, score):
+    """
+    Merge one scored pair into both clones' lists (a pair has one conversation and score, shown to
+    both) and trim them. An entry for the same versions is never overwritten.
+    """
+    for clone, match in ((user, other), (other, user)):
+        cursor.execute('''
+            INSERT INTO top_matches (clone_id, other_clone_id, clone_version, other_version, score)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (clone_id, other_clone_id) DO UPDATE SET
+                clone_version = excluded.clone_version, other_version = excluded.other_version, score = excluded.score
+            WHERE excluded.clone_version >= clone_version AND excluded.other_version >= other_version
+              AND (excluded.clone_version > clone_version OR excluded.other_version > other_version)
+        ''', (clone['id'], match['id'], clone['version'], match['version'], score))
+        # Entries merged while the clone had an older version were scored against its old answers
+        cursor.execute('DELETE FROM top_matches WHERE clone_id = ? AND clone_version < ?',
+                       (clone['id'], clone['version']))
+        # Only entries for the other clone's current version count towards TOP_N. Stale ones are left for
+        # that clone's refresh, which finds them with lists_with_stale and re-scores the pair
+        cursor.execute('''
+            DELETE FROM top_matches WHERE clone_id = ? AND other_clone_id IN (
+                SELECT t.other_clone_id FROM top_matches t
+                JOIN clones c ON c.id = t.other_clone_id AND c.version = t.other_version
+                WHERE t.clone_id = ?
+                ORDER BY t.score DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (clone['id'], clone['id'], TOP_N))
+
+
+def lists_with_stale(cursor, clone_id, version):
+    """Ids of the clones whose lists hold an older version of `clone_id` (they need the pair re-scored)."""
+    cursor.execute('SELECT clone_id FROM top_matches WHERE other_clone_id = ? AND other_version < ?',
+                   (clone_id, version))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def drop_stale(cursor, clone_id, version):
+    """Remove every entry made with an older version of `clone_id`, in its own list and in others'."""
+    cursor.execute('''
+        DELETE FROM top_matches
+        WHERE (clone_id = ? AND clone_version < ?) OR (other_clone_id = ? AND other_version < ?)
+    ''', (clone_id, version, clone_id, version))
+
+
+def load_top_matches(cursor, clone_id, version, limit=TOP_N):
+    """[{'id', 'username', 'profile_pic', 'name', 'score'}] best first, for this version of the clone."""
+    cursor.execute('''
+        SELECT t.other_clone_id, u.username, c.profile_pic_path, c.name, t.score
+        FROM top_matches t
+        JOIN clones c ON c.id = t.other_clone_id AND c.version = t.other_version
+        JOIN users u ON u.id = c.user_id
+        WHERE t.clone_id = ? AND t.clone_version = ?
+        ORDER BY t.score DESC
+        LIMIT ?
+    ''', (clone_id, version, limit))
+    return [{
+        'id': other_id,
+        'username': username,
+        'profile_pic': profile_pic_path,
+        'name': name or 'No_Name',
+        'score': score
+    } for other_id, username, profile_pic_path, name, score in cursor.fetchall()]
@@ -0,0 +1,138 @@
+# tracing.py
+# Lightweight per-request spans (SQLite, LLM, PIL, Jinja, filesystem), reported as a Server-Timing
+# header and, for a sample of requests, as one JSON line per request in a trace log.
+#
+#   TRACE_SAMPLE_RATE   fraction of requests written to the trace log (default 0 = off)
+#   TRACE_LOG_PATH      trace log file (default traces.jsonl)
+
+import contextvars
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))
+LOG_PATH = os.getenv('TRACE_LOG_PATH', 'traces.jsonl')
+
+_trace = contextvars.ContextVar('trace', default=None)
+_log_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, route):
+        self.route = route
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.sampled = SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+        self.spans = []  # (name, start offset, duration, detail); pool threads append too
+        self._lock = threading.Lock()
+
+    def add(self, name, start, duration, detail=None):
+        with self._lock:
+            self.spans.append((name, start - self.start, duration, detail))
+
+    def server_timing(self):
+        """Server-Timing header value: total time and count per span name, plus the whole request."""
+        totals = OrderedDict()
+        with self._lock:
+            for name, _, duration, _ in self.spans:
+                total = totals.setdefault(name, [0.0, 0])
+                total[0] += duration
+                total[1] += 1
+        parts = [f'{name};dur={duration * 1000:.1f};desc="{count}x"' for name, (duration, count) in totals.items()]
+        parts.append(f'total;dur={(time.perf_counter() - self.start) * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def start(route):
+    """Begin a trace for the current request; spans in this context (and copies of it) land in it."""
+    trace = Trace(route)
+    _trace.set(trace)
+    return trace
+
+
+def current():
+    return _trace.get()
+
+
+@contextmanager
+def span(name, detail=None):
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start, detail)
+
+
+def record(name, start, detail=None):
+    """Add a span that began at `start` (a perf_counter value) and ends now."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, start, time.perf_counter() - start, detail)
+
+
+def finish(trace, method, path, status):
+    """Append a sampled trace to the log once the response (including any stream) is done."""
+    if not trace.sampled:
+        return
+    with trace._lock:
+        spans = [{'name': name, 'start_ms': round(offset * 1000, 2), 'dur_ms': round(duration * 1000, 2),
+                  'detail': detail} for name, offset, duration, detail in sorted(trace.spans, key=lambda s: s[1])]
+    line = json.dumps({
+        'ts': trace.started_at,
+        'route': trace.route,
+        'method': method,
+        'path': path,
+        'status': status,
+        'dur_ms': round((time.perf_counter() - trace.start) * 1000, 2),
+        'spans': spans,
+    }, default=str)
+    with _log_lock:
+        with open(LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+# =========================
+# SQLite
+# =========================
+# sqlite3.connect('users.db', factory=TracedConnection) times every statement, fetch and commit
+# as a "db" span. Without an active trace the wrappers only cost a context variable lookup.
+class TracedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        with span('db', sql):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with span('db', sql):
+            return super().executemany(sql, seq_of_parameters)
+
+    def fetchone(self):
+        with span('db', 'fetchone'):
+            return super().fetchone()
+
+    def fetchall(self):
+        with span('db', 'fetchall'):
+            return super().fetchall()
+
+
+class TracedConnection(sqlite3.Connection):
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        with span('db', 'commit'):
+            return super().commit()
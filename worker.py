@@ -0,0 +1,44 @@
+# worker.py
+# Runs background job workers: python worker.py -n 4
+
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+
+from models import init_db
+from jobs import run_worker
+import tasks  # noqa: F401  (registers the job handlers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run CloneMe background job workers.')
+    parser.add_argument('-n', '--processes', type=int, default=2, help='number of worker processes')
+    parser.add_argument('--kinds', nargs='*', help='only run these job kinds')
+    parser.add_argument('--poll', type=float, default=1.0, help='seconds to sleep when the queue is empty')
+    parser.add_argument('--once', action='store_true', help='exit when the queue is drained')
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    init_db()
+    host = socket.gethostname()
+    if args.processes == 1:
+        run_worker(f'{host}:{os.getpid()}', args.kinds, args.poll, args.once)
+        return
+
+    processes = []
+    for i in range(args.processes):
+        p = multiprocessing.Process(target=run_worker, args=(f'{host}:{os.getpid()}-{i}', args.kinds, args.poll, args.once))
+        p.start()
+        processes.append(p)
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+
+
+if __name__ == '__main__':
+    main()